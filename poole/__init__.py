@@ -0,0 +1,35 @@
+""" poole
+
+Set the environment variable POOLE_IMPORTTIME to print the time spent for
+each module import to stderr (like `python -X importtime` in Python 3.7+).
+"""
+
+import os
+
+if os.environ.get("POOLE_IMPORTTIME"):
+
+    import __builtin__
+    import sys
+    import time
+
+    def _timed_import(name, *args, **kwargs):
+        stack.append(0) # time spent on nested imports
+        known = len(sys.modules)
+        start = time.time()
+        try:
+            return _import(name, *args, **kwargs)
+        finally:
+            total = time.time() - start
+            nested = stack.pop()
+            if stack:
+                stack[-1] += total
+            if len(sys.modules) > known: # not only a lookup
+                sys.stderr.write("import time: %9d | %10d | %s%s\n" % (
+                    (total - nested) * 1e6, total * 1e6, "  " * len(stack),
+                    name))
+
+    stack = []
+    _import = __builtin__.__import__
+    sys.stderr.write("import time: self [us] | cumulative | "
+                     "imported package\n")
+    __builtin__.__import__ = _timed_import
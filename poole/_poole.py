@@ -26,33 +26,51 @@
 from __future__ import with_statement
 
 import codecs
+import dis
+import filecmp
+import functools
 import glob
+import hashlib
 import imp
+import json
 import optparse
 import os
 from os.path import join as opj
 from os.path import exists as opx
+import posixpath
+import Queue
 import re
+try:
+    import resource
+except ImportError: # not available on Windows
+    resource = None
 import shutil
-import StringIO
+import signal
 import sys
+import tempfile
+import threading
+import time
 import traceback
-import urlparse
+import types
+import zlib
 
-from SimpleHTTPServer import SimpleHTTPRequestHandler
-from BaseHTTPServer import HTTPServer
+# modules only needed by some commands (e.g. `markdown` for building) are
+# imported where they are used, which keeps startup fast
 
-import markdown
+from version import __version__
 
 HERE = os.path.dirname(os.path.realpath(__file__))
 
 THEME_DIR = opj(HERE, 'themes')
 
-THEME_NAMES = ['minimal'] + [
-    os.path.basename(x)
-    for x in glob.glob(opj(THEME_DIR, '*'))
-    if os.path.isdir(x)
-]
+def theme_names():
+    """Names of the available themes."""
+
+    return ['minimal'] + [
+        os.path.basename(x)
+        for x in glob.glob(opj(THEME_DIR, '*'))
+        if os.path.isdir(x)
+    ]
 
 # =============================================================================
 # init site
@@ -120,8 +138,7 @@ EXAMPLE_FILES =  {
     </div>
     <div id="menu">
     <!--%
-        mpages = [p for p in pages if "menu-position" in p]
-        mpages.sort(key=lambda p: int(p["menu-position"]))
+        mpages = pages.sorted_by("menu-position", key=int)
         entry = '<span class="%s"><a href="%s">%s</a></span>'
         for p in mpages:
             style = "current" if p["title"] == page["title"] else ""
@@ -202,7 +219,7 @@ page. These attributes can then be used to generate a list of blog posts:
 
 <!--%
 from datetime import datetime
-posts = [p for p in pages if "post" in p] # get all blog post pages
+posts = pages.having("post") # get all blog post pages
 posts.sort(key=lambda p: p.get("date"), reverse=True) # sort post pages by date
 for p in posts:
     date = datetime.strptime(p.date, "%Y-%m-%d").strftime("%B %d, %Y")
@@ -284,6 +301,11 @@ her forward!
 def init(project, theme):
     """Initialize a site project."""
 
+    if theme not in theme_names():
+        print("abort  : unknown theme %r (choices: %s)" % (
+              theme, ", ".join(theme_names())))
+        sys.exit(1)
+
     if not opx(project):
         os.makedirs(project)
 
@@ -344,11 +366,22 @@ def hx(s):
     return ''.join(escape.get(c, c) for c in s)
 
 class Page(dict):
-    """Abstraction of a source page."""
+    """Abstraction of a source page.
+
+    Page attributes are dictionary items, which may also be read and set as
+    object attributes. Pages have no instance dictionary, which saves memory
+    on large sites.
+
+    """
+    __slots__ = ("_virtual", "_virtual_raw", "_source", "_modified", "_html",
+                 "_skip")
+
+    _version = 0 # incremented whenever any page's attributes change
 
     _template = None # template dictionary
     _opts = None # command line options
     _pstrip = None # path prefix to strip from (non-virtual) page file names
+    _headers = {} # parsed headers by file name, kept across builds
 
     _re_eom = re.compile(r'^---+ *\r?\n?$')
     _re_vardef = re.compile(r'^([^\n:=]+?)[:=]((?:.|\n )*)', re.MULTILINE)
@@ -375,6 +408,7 @@ class Page(dict):
         self.update(attrs)
 
         self._virtual = virtual is not None
+        self._virtual_raw = virtual
 
         fname = opj(self._pstrip, fname) if virtual else fname
 
@@ -384,21 +418,16 @@ class Page(dict):
         self["url"] = self["url"][len(self._pstrip):].lstrip(os.path.sep)
         self["url"] = self["url"].replace(os.path.sep, "/")
 
+        # only the attribute definitions are read now, the page content gets
+        # read when needed (see `source`)
+        self._source = None
+        self._modified = False # true if source has been set explicitly
+        self._html = ""
         if virtual:
-            self.raw = virtual
+            vardefs, self._skip, lines = self._split(virtual)
+            self._source = "".join(lines)
         else:
-            with codecs.open(fname, 'r', self._opts.input_enc) as fp:
-                self.raw = fp.readlines()
-
-        # split raw content into macro definitions and real content
-        vardefs = ""
-        self.source = ""
-        for line in self.raw:
-            if not vardefs and self._re_eom.match(line):
-                vardefs = self.source
-                self.source = "" # only macro defs until here, reset source
-            else:
-                self.source += line
+            vardefs, self._skip = self._header(fname)
 
         for key, val in self._re_vardef.findall(vardefs):
             key = key.strip()
@@ -416,314 +445,3107 @@ class Page(dict):
         if date and "date" not in self: self["date"] = date
         if post and "post" not in self: self["post"] = post
 
-        self.html = ""
+    def _header(self, fname):
+        """Get the attribute definitions of a page file and its length.
+
+        Headers are only read again if the file changed since the last build
+        (in the same process, e.g. in watch or daemon mode, or as recorded by
+        the `PageIndex`).
+
+        """
+        st = os.stat(fname)
+        stamp = (st.st_mtime, st.st_size, self._opts.input_enc)
+        cached = self._headers.get(fname)
+        if cached is None or cached[0] != stamp:
+            with codecs.open(fname, 'r', self._opts.input_enc) as fp:
+                lines = iter(fp.readline, u"") # stop reading at the header end
+                vardefs, skip, _ = self._split(lines, stop=True)
+            digest = file_sha1(fname)
+            cached = self._headers[fname] = (stamp, vardefs, skip, digest)
+        return cached[1:3]
+
+    def _split(self, lines, stop=False):
+        """Split raw content into macro definitions and real content.
+
+        Returns the macro definitions, the number of lines to skip to get to
+        the real content and the real content lines read. If `stop` is true,
+        reading stops at the end of the macro definitions.
+
+        """
+        vardefs = ""
+        source = []
+        skip = 0
+        for n, line in enumerate(lines):
+            if not vardefs and self._re_eom.match(line):
+                vardefs = "".join(source)
+                source = [] # only macro defs until here, reset source
+                skip = n + 1
+                if vardefs and stop:
+                    break
+            else:
+                source.append(line)
+        return vardefs, skip, source
+
+    @property
+    def raw(self):
+        """Raw content of the page (a list of lines for real pages)."""
+
+        if self._virtual:
+            return self._virtual_raw
+        with codecs.open(self.fname, 'r', self._opts.input_enc) as fp:
+            return fp.readlines()
+
+    def _get_source(self):
+        if self._source is None:
+            with codecs.open(self.fname, 'r', self._opts.input_enc) as fp:
+                lines = fp.readlines()
+            self._source = "".join(lines[self._skip:])
+        return self._source
+
+    def _set_source(self, source):
+        self._source = source
+        self._modified = True
+
+    source = property(_get_source, _set_source, doc="""Page content.
+
+    Read from the page file on first access.""")
+
+    def _get_html(self):
+        if self._html is None:
+            raise AttributeError("html of %s has been released" % self)
+        return self._html
+
+    def _set_html(self, html):
+        self._html = html
+
+    html = property(_get_html, _set_html, doc="""Page content as HTML.""")
+
+    def _digest(self):
+        """Hash of the page's content, without reading unchanged page files."""
+
+        if self._virtual or self._modified:
+            return sha1(self.source)
+        return self._headers[self.fname][3]
+
+    def unload(self):
+        """Free the page content if it can be read again from the page file.
+
+        Should be used once the page's source has been converted.
+
+        """
+        if not self._virtual and not self._modified:
+            self._source = None
+
+    def release(self):
+        """Free the page's content and HTML once all pages have been written.
+
+        Afterwards the page's source is read again if needed, but accessing
+        its HTML raises an `AttributeError`.
+
+        """
+        self.unload()
+        self._html = None
 
     def __getattr__(self, name):
         """Attribute-style access to dictionary items."""
+        prop = getattr(type(self), name, None)
+        if isinstance(prop, property): # failed, raise its error again
+            return prop.__get__(self)
         try:
             return self[name]
         except KeyError:
             raise AttributeError(name)
 
+    def __setattr__(self, name, value):
+        """Attribute-style setting of dictionary items."""
+        if hasattr(Page, name): # slots and properties
+            super(Page, self).__setattr__(name, value)
+        else:
+            self[name] = value
+
+    # track changes of page attributes (see `PageList`)
+
+    def _mutator(name):
+        method = getattr(dict, name)
+        def mutate(self, *args, **kwargs):
+            Page._version += 1
+            return method(self, *args, **kwargs)
+        mutate.__name__ = name
+        mutate.__doc__ = method.__doc__
+        return mutate
+
+    for _name in ("__setitem__", "__delitem__", "update", "setdefault", "pop",
+                  "popitem", "clear"):
+        locals()[_name] = _mutator(_name)
+
+    del _name, _mutator
+
     def __str__(self):
         """Page representation by file name."""
         return ('%s (virtual)' % self.fname) if self._virtual else self.fname
 
 # -----------------------------------------------------------------------------
 
-def build(project, opts):
-    """Build a site project."""
+class PageList(list):
+    """List of pages with query methods backed by lazily built indexes.
 
-    # -------------------------------------------------------------------------
-    # utilities
-    # -------------------------------------------------------------------------
+    Indexes are dropped whenever the list or any page changes.
 
-    def abort_iex(page, itype, inline, exc):
-        """Abort because of an exception in inlined Python code."""
-        print("abort  : Python %s in %s failed" % (itype, page))
-        print((" %s raising the exception " % itype).center(79, "-"))
-        print(inline)
-        print(" exception ".center(79, "-"))
-        print(exc)
-        sys.exit(1)
+    """
+    def __init__(self, *args):
 
-    # -------------------------------------------------------------------------
-    # regex patterns and replacements
-    # -------------------------------------------------------------------------
+        super(PageList, self).__init__(*args)
+        self._indexes = {}
+        self._built = None # list and page versions the indexes are valid for
+        self._version = 0
 
-    regx_escp = re.compile(r'\\((?:(?:&lt;|<)!--|{)(?:{|%))') # escaped code
-    repl_escp = r'\1'
-    regx_rurl = re.compile(r'(?<=(?:(?:\n| )src|href)=")([^#/&%].*?)(?=")')
-    repl_rurl = lambda m: urlparse.urljoin(opts.base_url, m.group(1))
+    def _changed(self):
+        self._version += 1
+
+    def _index(self, key, build):
+        """Get the index `key`, build it using `build()` if needed."""
+
+        state = (self._version, Page._version)
+        if self._built != state:
+            self._indexes.clear()
+            self._built = state
+        if key not in self._indexes:
+            self._indexes[key] = build()
+        return self._indexes[key]
+
+    def having(self, *names):
+        """Get pages which have all the given attributes."""
+
+        def build():
+            return [p for p in self if all(n in p for n in names)]
+
+        return list(self._index(("having", names), build))
+
+    def where(self, attrs=None, **kwargs):
+        """Get pages whose attributes have the given values.
+
+        Attributes may be given as keyword arguments or as a dictionary (for
+        attribute names which are no valid Python identifiers).
+
+        """
+        attrs = dict(attrs or {}, **kwargs)
+        result = None
+        for name, value in attrs.items():
+
+            def build(name=name):
+                index = {}
+                for p in self:
+                    try:
+                        index.setdefault(p[name], []).append(p)
+                    except (KeyError, TypeError): # unset or unhashable
+                        pass
+                return index
+
+            matches = self._index(("where", name), build).get(value, [])
+            if result is None:
+                result = matches
+            else:
+                ids = set(id(p) for p in matches)
+                result = [p for p in result if id(p) in ids]
+        return list(self if result is None else result)
 
-    regx_eval = re.compile(r'(?<!\\)(?:(?:<!--|{){)(.*?)(?:}(?:-->|}))', re.S)
+    def sorted_by(self, name, key=None, reverse=False):
+        """Get pages which have the attribute `name`, sorted by its value.
 
-    def repl_eval(m):
-        """Replace a Python expression block by its evaluation."""
+        If given, `key` is applied to attribute values before comparing them
+        (e.g. `int`). The order of pages with equal values is kept. Only
+        sorting without `key` is cached -- code like `key=lambda v: ...` in
+        `page.html` creates a new function for every page, whose index would
+        never be used again.
 
-        expr = m.group(1)
+        """
+        if key is not None:
+            pages = self.having(name)
+            pages.sort(key=lambda p: key(p[name]), reverse=reverse)
+            return pages
+
+        def build():
+            pages = [p for p in self if name in p]
+            pages.sort(key=lambda p: p[name], reverse=reverse)
+            return pages
+
+        return list(self._index(("sorted_by", name, reverse), build))
+
+    # track changes of the list
+
+    def _mutator(name):
+        method = getattr(list, name)
+        def mutate(self, *args, **kwargs):
+            result = method(self, *args, **kwargs)
+            self._changed()
+            return result
+        mutate.__name__ = name
+        mutate.__doc__ = method.__doc__
+        return mutate
+
+    for _name in ("append", "extend", "insert", "remove", "pop", "reverse",
+                  "sort", "__setitem__", "__delitem__", "__setslice__",
+                  "__delslice__", "__iadd__", "__imul__"):
+        locals()[_name] = _mutator(_name)
+
+    del _name, _mutator
+
+# -----------------------------------------------------------------------------
+
+class PageIndex(object):
+    """Persistent index of page attributes, kept in `.poole/pages.db`.
+
+    The index is an SQLite database with one row per page file, holding the
+    page's URL, its raw attribute definitions, the resulting attributes (as
+    JSON, without changes made later by hooks) and a hash of the file. Builds
+    use it to skip reading unchanged page files, other tools may query it to
+    get the structure of a site. If Python lacks `sqlite3`, there is no index.
+
+    """
+    _version = "1"
+
+    def __init__(self, project, dir_in):
+
+        self.fname = opj(project, ".poole", "pages.db")
+        self.dir_in = dir_in
+        self.db = None
+        self.template = None # key over the page template of the last build
+        self.rows = {} # loaded rows by relative file name
         try:
-            repl = eval(expr, macros.copy())
-        except:
-            abort_iex(page, "expression", expr, traceback.format_exc())
-        else:
-            if not isinstance(repl, basestring): # e.g. numbers
-                repl = unicode(repl)
-            elif not isinstance(repl, unicode):
-                repl = repl.decode("utf-8")
-            return repl
+            import sqlite3
+        except ImportError:
+            return
+        if not opx(os.path.dirname(self.fname)):
+            os.makedirs(os.path.dirname(self.fname))
+        try:
+            self.db = sqlite3.connect(self.fname)
+            self.db.execute("CREATE TABLE IF NOT EXISTS meta "
+                            "(key TEXT PRIMARY KEY, value TEXT)")
+            meta = dict(self.db.execute("SELECT key, value FROM meta"))
+            if meta.get("version") != self._version:
+                self.db.execute("DROP TABLE IF EXISTS pages")
+            self.db.execute("CREATE TABLE IF NOT EXISTS pages ("
+                            "path TEXT PRIMARY KEY, url TEXT, mtime REAL, "
+                            "size INTEGER, enc TEXT, digest TEXT, "
+                            "skip INTEGER, vardefs TEXT, attrs TEXT)")
+            self.db.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)",
+                            ("version", self._version))
+            self.template = meta.get("template")
+        except sqlite3.DatabaseError as e:
+            print("warning: ignoring page index %s (%s)" % (self.fname, e))
+            self.db = None
+
+    def load(self):
+        """Make page headers in the index known to `Page`."""
+
+        if self.db is None:
+            return
+        for row in self.db.execute("SELECT path, mtime, size, enc, digest, "
+                                   "skip, vardefs FROM pages"):
+            path, mtime, size, enc, digest, skip, vardefs = row
+            self.rows[path] = (mtime, size, enc, digest)
+            Page._headers.setdefault(opj(self.dir_in, path),
+                                     ((mtime, size, enc), vardefs, skip,
+                                      digest))
+
+    def update(self, pages):
+        """Record the (non-virtual) pages of a build, drop removed ones."""
+
+        if self.db is None:
+            return
+        template = sha1(repr(sorted(Page._template.items())))
+        changed, paths = [], set()
+        for page in pages:
+            if page._virtual:
+                continue
+            path = os.path.relpath(page.fname, self.dir_in)
+            paths.add(path)
+            (mtime, size, enc), vardefs, skip, digest = \
+                Page._headers[page.fname]
+            if self.rows.get(path) == (mtime, size, enc, digest) and \
+               template == self.template:
+                continue
+            attrs = json.dumps(dict(page), sort_keys=True, default=repr)
+            changed.append((path, page.url, mtime, size, enc, digest, skip,
+                            vardefs, attrs))
+        removed = [(path,) for path in set(self.rows) - paths]
+        self.db.executemany("INSERT OR REPLACE INTO pages VALUES "
+                            "(?, ?, ?, ?, ?, ?, ?, ?, ?)", changed)
+        self.db.executemany("DELETE FROM pages WHERE path = ?", removed)
+        self.db.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)",
+                        ("template", template))
+        self.db.commit()
+        self.db.close()
+        if changed or removed:
+            count("page index updates", len(changed) + len(removed))
 
-    regx_exec = re.compile(r'(?<!\\)(?:(?:<!--|{)%)(.*?)(?:%(?:-->|}))', re.S)
+# -----------------------------------------------------------------------------
 
-    def repl_exec(m):
-        """Replace a block of Python statements by their standard output."""
+class BuildCache(object):
+    """Dictionary-like cache which forgets entries not used by recent builds.
 
-        stmt = m.group(1).replace("\r\n", "\n")
+    Caches kept across builds (in watch and daemon mode) would grow forever,
+    e.g. with statements compiled from per-page expression output. Calling
+    `new_build()` at the start of a build drops all entries which have not
+    been used since the previous call.
 
-        # base indentation
-        ind_lvl = len(re.findall(r'^(?: *\n)*( *)', stmt, re.MULTILINE)[0])
-        ind_rex = re.compile(r'^ {0,%d}' % ind_lvl, re.MULTILINE)
-        stmt = ind_rex.sub('', stmt)
+    """
+    def __init__(self):
+
+        self._cur = {} # entries used by the current build
+        self._prev = {} # entries used by the previous build only
 
-        # execute
-        sys.stdout = StringIO.StringIO()
+    def __contains__(self, key):
+
+        if key in self._cur:
+            return True
         try:
-            exec stmt in macros.copy()
-        except:
-            sys.stdout = sys.__stdout__
-            abort_iex(page, "statements", stmt, traceback.format_exc())
-        else:
-            repl = sys.stdout.getvalue()[:-1] # remove last line break
-            sys.stdout = sys.__stdout__
-            if not isinstance(repl, unicode):
-                repl = repl.decode(opts.input_enc)
-            return repl
+            self._cur[key] = self._prev.pop(key)
+        except KeyError:
+            return False
+        return True
 
-    # -------------------------------------------------------------------------
-    # preparations
-    # -------------------------------------------------------------------------
+    def __getitem__(self, key):
 
-    dir_in = opj(project, "input")
-    dir_out = opj(project, "output")
-    page_html = opj(project, "page.html")
+        if key not in self:
+            raise KeyError(key)
+        return self._cur[key]
 
-    # check required files and folders
-    for pelem in (page_html, dir_in, dir_out):
-        if not opx(pelem):
-            print("abort  : %s does not exist, looks like project has not been "
-                  "initialized" % pelem)
-            sys.exit(1)
+    def __setitem__(self, key, value):
 
-    # prepare output directory
-    for fod in glob.glob(opj(dir_out, "*")):
-        if os.path.isdir(fod):
-            shutil.rmtree(fod)
-        else:
-            os.remove(fod)
-    if not opx(dir_out):
-        os.mkdir(dir_out)
+        self._cur[key] = value
 
-    # macro module
-    fname = opj(opts.project, "macros.py")
-    macros = imp.load_source("macros", fname).__dict__ if opx(fname) else {}
+    def __len__(self):
 
-    macros["__encoding__"] = opts.output_enc
-    macros["options"] = opts
-    macros["project"] = project
-    macros["input"] = dir_in
-    macros["output"] = dir_out
+        return len(self._cur) + len(self._prev)
 
-    # "builtin" items for use in macros and templates
-    macros["hx"] = hx
-    macros["htmlspecialchars"] = hx # legacy name of `htmlx` function
-    macros["Page"] = Page
+    def new_build(self):
+        """Forget entries which have not been used by the last build."""
 
-    # -------------------------------------------------------------------------
-    # process input files
-    # -------------------------------------------------------------------------
+        self._prev, self._cur = self._cur, {}
 
-    Page._template = macros.get("page", {})
-    Page._opts = opts
-    Page._pstrip = dir_in
-    pages = []
-    custom_converter = macros.get('converter', {})
+# -----------------------------------------------------------------------------
 
-    for cwd, dirs, files in os.walk(dir_in.decode(opts.filename_enc)):
-        cwd_site = cwd[len(dir_in):].lstrip(os.path.sep)
-        for sdir in dirs[:]:
-            if re.search(opts.ignore, opj(cwd_site, sdir)):
-                dirs.remove(sdir)
-            else:
-                os.mkdir(opj(dir_out, cwd_site, sdir))
-        for f in files:
-            if re.search(opts.ignore, opj(cwd_site, f)):
-                pass
-            elif re.search(MKD_PATT, f):
-                page = Page(opj(cwd, f))
-                pages.append(page)
-            else:
-                # either use a custom converter or do a plain copy
-                for patt, (func, ext) in custom_converter.items():
-                    if re.search(patt, f):
-                        f_src = opj(cwd, f)
-                        f_dst = opj(dir_out, cwd_site, f)
-                        f_dst = '%s.%s' % (os.path.splitext(f_dst)[0], ext)
-                        print('info   : convert %s (%s)' % (f_src, func.__name__))
-                        func(f_src, f_dst)
-                        break
-                else:
-                    src = opj(cwd, f)
-                    try:
-                        shutil.copy(src, opj(dir_out, cwd_site))
-                    except OSError:
-                        # some filesystems like FAT won't allow shutil.copy
-                        shutil.copyfile(src, opj(dir_out, cwd_site, f))
+class Template(object):
+    """Text with embedded Python expressions and statements, parsed once.
 
-    pages.sort(key=lambda p: int(p.get("sval", "0")))
+    Rendering a template is equivalent to first replacing all expression
+    blocks by their evaluation and then replacing all statement blocks in the
+    resulting text by their output. The text is split into literal text,
+    expressions and statements (compiled to code objects) once, so rendering
+    only has to walk these segments.
 
-    macros["pages"] = pages
+    In the rare case an expression evaluates to something which could form
+    a statement block together with the surrounding text, rendering falls
+    back to matching statement blocks in the expanded text.
 
-    # -------------------------------------------------------------------------
-    # run pre-convert hooks in macro module (named 'once' before)
-    # -------------------------------------------------------------------------
+    """
+    _re_eval = re.compile(r'(?<!\\)(?:(?:<!--|{){)(.*?)(?:}(?:-->|}))', re.S)
+    _re_exec = re.compile(r'(?<!\\)(?:(?:<!--|{)%)(.*?)(?:%(?:-->|}))', re.S)
 
-    hooks = [a for a in macros if re.match(r'hook_preconvert_|once_', a)]
-    for fn in sorted(hooks):
-        macros[fn]()
+    # expression output which may affect matching statement blocks
+    _re_mixed = re.compile(r'(?:<!--|{)%|%(?:-->|})|^-{0,2}%|%-{0,2}$|'
+                           r'^[}>-]|[\\{<!-]$')
 
-    # -------------------------------------------------------------------------
-    # convert pages (markdown to HTML)
-    # -------------------------------------------------------------------------
+    _PH = u"\0" # placeholder for expression output
 
-    for page in pages:
+    _codes = BuildCache() # compiled code by source and mode (all templates)
 
-        print("info   : convert %s" % page)
+    def __init__(self, text, name=None, first=1):
+        """Parse a template.
 
-        # replace expressions and statements in page source
-        macros["page"] = page
-        out = regx_eval.sub(repl_eval, page.source)
-        out = regx_exec.sub(repl_exec, out)
+        `name` and the number of the text's `first` line are used to tell
+        code runners where a code block is located.
 
-        # convert to HTML
-        extensions = opts.md_ext
-        extensions.append('markdown.extensions.fenced_code')
-        extensions.append('markdown.extensions.tables')
-        extensions.append('markdown.extensions.admonition')
-        extensions = list(set(extensions))
+        """
+        self.name = name
+
+        parts = self._re_eval.split(text)
+        self._literals = parts[0::2]
+        self._exprs = []
+        lineno, elines = first, [0] # line breaks in preceding expressions
+        for literal, expr in zip(parts[0::2], parts[1::2]):
+            lineno += literal.count("\n")
+            self._exprs.append((self._code(expr.lstrip(" \t"), "eval"), expr,
+                                (name, lineno)))
+            lineno += expr.count("\n")
+            elines.append(elines[-1] + expr.count("\n"))
+
+        # segments: literal text, expression indexes or statement blocks
+        self._segments = []
+        self._static = self._PH not in text
+        if not self._static:
+            return
+
+        skel = self._PH.join(self._literals)
+        pos, i, lineno = 0, 0, first
+        for m in self._re_exec.finditer(skel):
+            lineno += skel.count("\n", pos, m.start())
+            i = self._add_literal(skel[pos:m.start()], i)
+            where = (name, lineno + elines[i])
+            stmt = m.group(1)
+            if self._PH in stmt: # depends on expressions, compile on render
+                n = stmt.count(self._PH)
+                self._segments.append((stmt.split(self._PH), range(i, i + n),
+                                       where))
+                i += n
+            else:
+                self._segments.append(self._stmt(stmt) + (where,))
+            lineno += skel.count("\n", m.start(), m.end())
+            pos = m.end()
+        self._add_literal(skel[pos:], i)
+
+    def _add_literal(self, text, i):
+        """Add literal text segments, return index of next expression."""
+
+        chunks = text.split(self._PH)
+        for chunk in chunks[:-1]:
+            if chunk:
+                self._segments.append(chunk)
+            self._segments.append(i)
+            i += 1
+        if chunks[-1]:
+            self._segments.append(chunks[-1])
+        return i
+
+    def _code(self, source, mode):
+        """Compile code, leave it as string if it has errors.
+
+        Code with errors gets reported when rendering the template, just like
+        code with runtime errors.
 
-        page.html = markdown.Markdown(extensions=extensions).convert(out)
+        """
+        key = (source, mode)
+        if key not in self._codes:
+            try:
+                self._codes[key] = compile(source, "<string>", mode)
+            except Exception: # e.g. SyntaxError or ValueError
+                self._codes[key] = source
+        return self._codes[key]
 
-    # -------------------------------------------------------------------------
-    # run post-convert hooks in macro module
-    # -------------------------------------------------------------------------
+    def _stmt(self, stmt):
+        """Prepare and compile a block of statements."""
 
-    hooks = [a for a in macros if a.startswith("hook_postconvert_")]
-    for fn in sorted(hooks):
-        macros[fn]()
+        stmt = stmt.replace("\r\n", "\n")
 
-    # -------------------------------------------------------------------------
-    # render complete HTML pages
-    # -------------------------------------------------------------------------
+        # base indentation
+        ind_lvl = len(re.findall(r'^(?: *\n)*( *)', stmt, re.MULTILINE)[0])
+        ind_rex = re.compile(r'^ {0,%d}' % ind_lvl, re.MULTILINE)
+        stmt = ind_rex.sub('', stmt)
 
-    with codecs.open(opj(project, "page.html"), 'r', opts.input_enc) as fp:
-        skeleton = fp.read()
+        return (self._code(stmt, "exec"), stmt)
 
-    for page in pages:
+    def names(self):
+        """Get all global names used by the template's code.
 
-        print("info   : render %s" % page.url)
+        Returns `None` if this cannot be known in advance (i.e. if the code
+        of a block depends on the output of other blocks or has errors).
 
-        # replace expressions and statements in page.html
-        macros["page"] = page
-        macros["__content__"] = page.html
-        out = regx_eval.sub(repl_eval, skeleton)
-        out = regx_exec.sub(repl_exec, out)
+        """
+        if not self._static:
+            return None
+        codes = [code for code, _, _ in self._exprs]
+        for seg in self._segments:
+            if isinstance(seg, tuple):
+                if isinstance(seg[0], list):
+                    return None
+                codes.append(seg[0])
+        names = set()
+        for code in codes:
+            if not isinstance(code, types.CodeType):
+                return None
+            names.update(_all_names(code))
+        return names
+
+    def render(self, run_eval, run_exec):
+        """Render the template.
+
+        `run_eval` and `run_exec` get a code object (or string), the
+        corresponding source and its location as a tuple of the template's
+        name and a line number (`None` if unknown). They must return the
+        unicode evaluation of an expression and the output of statements
+        respectively.
 
-        # un-escape escaped python code blocks
-        out = regx_escp.sub(repl_escp, out)
+        """
+        outs = [run_eval(*expr) for expr in self._exprs]
+
+        if not self._static or any(self._re_mixed.search(o) for o in outs):
+            text = [self._literals[0]]
+            for out, literal in zip(outs, self._literals[1:]):
+                text.append(out)
+                text.append(literal)
+            where = (self.name, None)
+            repl = lambda m: run_exec(*self._stmt(m.group(1)) + (where,))
+            return self._re_exec.sub(repl, u"".join(text))
+
+        text = []
+        for seg in self._segments:
+            if isinstance(seg, basestring):
+                text.append(seg)
+            elif isinstance(seg, int):
+                text.append(outs[seg])
+            elif isinstance(seg[0], list): # statements using expressions
+                chunks, idxs, where = seg
+                stmt = chunks[0]
+                for i, chunk in zip(idxs, chunks[1:]):
+                    stmt += outs[i] + chunk
+                text.append(run_exec(*self._stmt(stmt) + (where,)))
+            else:
+                text.append(run_exec(*seg))
+        return u"".join(text)
 
-        # make relative links absolute
-        #out = regx_rurl.sub(repl_rurl, out)
+# -----------------------------------------------------------------------------
 
-        # write HTML page
-        fname = page.fname.replace(dir_in, dir_out)
-        fname = re.sub(MKD_PATT, ".html", fname)
-        with codecs.open(fname, 'w', opts.output_enc) as fp:
-            fp.write(out)
+def _code_names(code, ops):
+    """Names used by the given opcodes in a (Python 2) code object."""
+
+    names, co, i, ext = set(), code.co_code, 0, 0
+    while i < len(co):
+        op = ord(co[i])
+        if op < dis.HAVE_ARGUMENT:
+            i += 1
+            continue
+        arg = ord(co[i + 1]) + ord(co[i + 2]) * 256 + ext
+        ext, i = 0, i + 3
+        if op == dis.EXTENDED_ARG:
+            ext = arg * 65536
+        elif op in ops:
+            names.add(code.co_names[arg])
+    return names
+
+def _nested_codes(code):
+    """All code objects nested in a code object (functions, classes, ...)."""
+
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            yield const
+            for nested in _nested_codes(const):
+                yield nested
+
+def _all_names(code):
+    """Names used by a code object and the code objects nested in it."""
+
+    names = set(code.co_names)
+    for nested in _nested_codes(code):
+        names.update(nested.co_names)
+    return names
+
+_CONTENT = "pages.content" # pseudo name for the content of pages
+
+_CONTENT_NAMES = frozenset(["source", "raw", "html", "getattr"])
+
+def macro_deps(names, macros, seen=None):
+    """Get the names of the macros data some code depends on.
+
+    `names` are the global names used by the code. Functions defined in the
+    macros module are replaced by the names used by their code, decorated
+    functions by those of the function they wrap (`__wrapped__`). Poole's own
+    functions, classes and modules are considered to be static. Returns
+    `None` if the code calls other functions, whose dependencies are unknown.
+    The current `page` and its `__content__` are not included. If the code
+    may read the content of pages, the result includes `_CONTENT`.
 
-    print("success: built project")
+    """
+    deps = set()
+    seen = set(["page", "__content__"]) if seen is None else seen
+    if not _CONTENT_NAMES.isdisjoint(names):
+        deps.add(_CONTENT)
+    static = (type, types.ClassType, types.ModuleType,
+              types.BuiltinFunctionType, types.MethodType)
+    for name in names:
+        if name in seen or name not in macros:
+            continue
+        seen.add(name)
+        obj = macros[name]
+        while getattr(obj, "__wrapped__", None) is not None:
+            obj = obj.__wrapped__
+        if isinstance(obj, types.FunctionType):
+            if obj.func_globals is macros:
+                used = macro_deps(_all_names(obj.func_code), macros, seen)
+                if used is None:
+                    return None
+                deps.update(used)
+            elif obj.func_globals is not globals():
+                return None
+        elif not isinstance(obj, static):
+            deps.add(name)
+    return deps
+
+_shareable = BuildCache() # code object -> can run on shared macros namespace
+
+_SHARE_BLOCKERS = set(["globals", "locals", "vars"])
+
+def block_namespace(code, macros):
+    """Get globals and locals to run an inline code block with.
+
+    Blocks must not leak variables into each other. Usually it is enough to
+    run them with private locals on top of the shared macros namespace, which
+    avoids copying the macros namespace for every block. Blocks whose
+    variables are looked up as globals (i.e. from functions they define),
+    which write or delete globals or which access the namespace explicitly
+    get a private copy of the macros namespace instead.
 
-# =============================================================================
-# serve site
-# =============================================================================
+    """
+    if not isinstance(code, types.CodeType): # source with errors
+        return macros.copy(), None
+
+    if code not in _shareable:
+        ops = dis.opmap
+        glob_ops = set([ops["STORE_GLOBAL"], ops["DELETE_GLOBAL"]])
+        bound = _code_names(code, set([ops["STORE_NAME"]]))
+        shareable = not (_code_names(code, set([ops["DELETE_NAME"]])) or
+                         _code_names(code, glob_ops) or
+                         _SHARE_BLOCKERS & set(code.co_names))
+        for nested in _nested_codes(code):
+            if not shareable:
+                break
+            shareable = not (bound & set(nested.co_names) or
+                             _code_names(nested, glob_ops) or
+                             _SHARE_BLOCKERS & set(nested.co_names))
+        _shareable[code] = shareable
+
+    if _shareable[code]:
+        return macros, {}
+    return macros.copy(), None
 
-def serve(project, port):
-    """Temporary serve a site project."""
+# -----------------------------------------------------------------------------
 
-    root = opj(project, "output")
-    if not os.listdir(project):
-        print("abort  : output dir is empty (build project first!)")
-        sys.exit(1)
+class StdoutCapture(object):
+    """Replacement for `sys.stdout` which captures output per thread.
 
-    os.chdir(root)
-    print 'serving on port: ',port
-    server = HTTPServer(('', port), SimpleHTTPRequestHandler)
-    server.serve_forever()
+    While a thread captures output (e.g. of `print` statements in inline
+    code), everything it writes to `sys.stdout` is collected in a buffer of
+    that thread. Output of other threads still goes to the real stdout.
+    Captures may be nested.
 
-# =============================================================================
-# options
-# =============================================================================
+    """
+    def __init__(self, stream):
 
-def options():
-    """Parse and validate command line arguments."""
+        self._stream = stream
+        self._local = threading.local()
 
-    usage = ("Usage: %prog --init  [OPTIONS] [path/to/project]\n"
-             "       %prog --build [OPTIONS] [path/to/project]\n"
-             "       %prog --serve [OPTIONS] [path/to/project]\n"
-             "\n"
-             "       Project path is optional, '.' is used as default.")
+    @classmethod
+    def install(cls):
+        """Make sure `sys.stdout` is a capture object and return it."""
 
-    op = optparse.OptionParser(usage=usage)
+        if not isinstance(sys.stdout, cls):
+            sys.stdout = cls(sys.stdout)
+        return sys.stdout
 
-    op.add_option("-i" , "--init", action="store_true", default=False,
-                  help="init project")
-    op.add_option("-b" , "--build", action="store_true", default=False,
-                  help="build project")
-    op.add_option("-s" , "--serve", action="store_true", default=False,
-                  help="serve project")
+    def begin(self):
+        """Start capturing output of the current thread, return a mark."""
 
-    og = optparse.OptionGroup(op, "Init options")
-    og.add_option("", "--theme", type="choice", default="minimal",
-                  choices=THEME_NAMES,
-                  help="theme for a new project (choices: %s)" % ', '.join(THEME_NAMES))
-    op.add_option_group(og)
+        local = self._local
+        if not hasattr(local, "buf"):
+            local.buf, local.depth, local.softspace = [], 0, 0
+        mark = (len(local.buf), local.softspace)
+        local.depth += 1
+        local.softspace = 0
+        return mark
 
-    og = optparse.OptionGroup(op, "Build options")
-    og.add_option("", "--base-url", default="/", metavar="URL",
-                  help="base url for relative links (default: /)")
-    og.add_option("" , "--ignore", default=r"^\.|~$", metavar="REGEX",
-                  help="input files to ignore (default: '^\.|~$')")
-    og.add_option("" , "--md-ext", default=[], metavar="EXT",
-                  action="append", help="enable a markdown extension")
-    og.add_option("", "--input-enc", default="utf-8", metavar="ENC",
-                  help="encoding of input pages (default: utf-8)")
-    og.add_option("", "--output-enc", default="utf-8", metavar="ENC",
-                  help="encoding of output pages (default: utf-8)")
-    og.add_option("", "--filename-enc", default="utf-8", metavar="ENC",
-                  help="encoding of file names (default: utf-8)")
-    op.add_option_group(og)
+    def end(self, mark):
+        """Stop capturing, return output written since `mark`."""
 
-    og = optparse.OptionGroup(op, "Serve options")
-    og.add_option("" , "--port", default=8080,
-                  metavar="PORT", type="int",
-                  help="port for serving (default: 8080)")
-    op.add_option_group(og)
+        local = self._local
+        out = "".join(local.buf[mark[0]:])
+        del local.buf[mark[0]:]
+        local.depth -= 1
+        local.softspace = mark[1]
+        return out
 
-    opts, args = op.parse_args()
+    def _capturing(self):
 
-    if opts.init + opts.build + opts.serve < 1:
-        op.print_help()
+        return getattr(self._local, "depth", 0) > 0
+
+    def write(self, s):
+
+        if self._capturing():
+            self._local.buf.append(s)
+            return
+        enc = getattr(self._stream, "encoding", None)
+        if isinstance(s, unicode) and enc: # like `print` to a real file
+            s = s.encode(enc)
+        self._stream.write(s)
+
+    def writelines(self, lines):
+
+        for line in lines:
+            self.write(line)
+
+    # used by the `print` statement
+    def _get_softspace(self):
+        if self._capturing():
+            return self._local.softspace
+        return getattr(self._stream, "softspace", 0)
+
+    def _set_softspace(self, value):
+        if self._capturing():
+            self._local.softspace = value
+        else:
+            try:
+                self._stream.softspace = value
+            except AttributeError:
+                pass
+
+    softspace = property(_get_softspace, _set_softspace)
+
+    def __getattr__(self, name):
+
+        return getattr(self._stream, name)
+
+# -----------------------------------------------------------------------------
+
+_fragments = {} # build-scoped cache of fragments (see `cached_fragment`)
+
+def _pages_state(pages):
+    """Something which changes whenever `pages` or any page changes."""
+
+    return getattr(pages, "_version", id(pages)), Page._version
+
+def cached_fragment(key=None):
+    """Decorator caching the output of a macros function during a build.
+
+    Use this for functions generating content which is the same for many
+    pages, e.g. a menu. The decorated function runs only once per distinct
+    combination of arguments and the value returned by `key` (a function
+    without arguments, e.g. `lambda: page["url"]`). The result and anything
+    printed by the function are replayed on subsequent calls. The cache is
+    cleared whenever the list of pages or any page attributes change.
+
+    """
+    def decorate(func):
+
+        @functools.wraps(func)
+        def cached(*args, **kwargs):
+            ckey = (func, key and key(), args, tuple(sorted(kwargs.items())),
+                    _pages_state(func.func_globals.get("pages")))
+            try:
+                out, result = _fragments[ckey]
+            except KeyError:
+                count("fragment cache misses")
+            except TypeError: # unhashable key
+                return func(*args, **kwargs)
+            else:
+                count("fragment cache hits")
+                sys.stdout.write(out)
+                return result
+            stdout = StdoutCapture.install()
+            mark = stdout.begin()
+            try:
+                result = func(*args, **kwargs)
+            finally:
+                out = stdout.end(mark)
+            _fragments[ckey] = (out, result)
+            sys.stdout.write(out)
+            return result
+
+        cached.__wrapped__ = func # lets macro_deps() see what it depends on
+        return cached
+
+    return decorate
+
+_re_cache_marker = re.compile(r'^\s*#\s*cache:(.*)')
+
+_cache_markers = BuildCache() # statement source -> key expression or None
+
+def cache_marker(stmt):
+    """Get the compiled key expression of a cached statement block.
+
+    A statement block is cached if its first line is a comment like
+    `# cache: page["url"]`. Returns `None` for other blocks.
+
+    """
+    if stmt not in _cache_markers:
+        m = _re_cache_marker.match(stmt.lstrip("\n"))
+        if m is None:
+            _cache_markers[stmt] = None
+        else:
+            expr = m.group(1).strip() or "None"
+            _cache_markers[stmt] = (compile(expr, "<string>", "eval"), expr)
+    return _cache_markers[stmt]
+
+# -----------------------------------------------------------------------------
+
+def sha1(*parts):
+    """Hex digest over the given (unicode or byte) strings."""
+
+    h = hashlib.sha1()
+    for part in parts:
+        if isinstance(part, unicode):
+            part = part.encode("utf-8")
+        h.update(part)
+        h.update("\0")
+    return h.hexdigest()
+
+def file_sha1(fname):
+    """Hex digest of a file's content, read in chunks."""
+
+    h = hashlib.sha1()
+    with open(fname, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(65536), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+class Manifest(object):
+    """Persistent build state used for incremental builds.
+
+    The manifest lives in the project's `.poole` directory and records for
+    every page and asset the keys of the inputs it has been built from as
+    well as the output files produced. A *stamp* covers everything which may
+    affect all pages (`macros.py` and build options) -- if it changes, every
+    page gets rebuilt. Additionally the keys of a page cover its attributes,
+    its source, `page.html` and the macros data (e.g. `pages`) used by the
+    inline code in the page's source and in `page.html`.
+
+    """
+
+    def __init__(self, project):
+
+        self.dir = opj(project, ".poole")
+        self.fname = opj(self.dir, "manifest.json")
+        self.old = {}
+        if opx(self.fname):
+            try:
+                with open(self.fname) as fp:
+                    self.old = json.load(fp)
+            except ValueError:
+                print("warning: ignoring corrupt manifest %s" % self.fname)
+        self.new = {"pages": {}, "assets": {}, "converted": {}, "dirs": []}
+
+    def prepare(self, *parts):
+        """Set the build stamp."""
+
+        self.new["stamp"] = sha1(*parts)
+
+    def _cache(self, page):
+        """Name of the file caching the converted HTML of a page."""
+
+        return opj(self.dir, "html", "%s.html" % sha1(page.url))
+
+    def page_key(self, page, deps):
+        """Key over a page's attributes, source and used macros data.
+
+        `deps` is a key over the macros data used by the page's source or
+        `None` if this is unknown, in which case the key is `None` too.
+
+        """
+        if deps is None:
+            return None
+        attrs = repr(sorted(page.items()))
+        return sha1(self.new["stamp"], attrs, page.source, deps)
+
+    def load_html(self, page, key):
+        """Load cached HTML into `page` if it was converted from `key`."""
+
+        entry = self.old.get("pages", {}).get(page.url)
+        fname = self._cache(page)
+        if key is None or not entry or entry.get("ckey") != key:
+            return False
+        if not opx(fname):
+            return False
+        with codecs.open(fname, 'r', 'utf-8') as fp:
+            page.html = fp.read()
+        return True
+
+    def store_html(self, page, key):
+        """Cache the converted HTML of `page`."""
+
+        fname = self._cache(page)
+        if not opx(os.path.dirname(fname)):
+            os.makedirs(os.path.dirname(fname))
+        with codecs.open(fname, 'w', 'utf-8') as fp:
+            fp.write(page.html)
+
+    def page_done(self, page, ckey, layout, dst, dir_out):
+        """Record a page and check if its output `dst` is up to date.
+
+        `layout` is a key over `page.html` and the macros data used by it (or
+        `None` if unknown). `ckey` is the page's conversion key, `None` if
+        unknown (e.g. for virtual pages added by post-convert hooks). Returns
+        true if `dst` has been rendered from the same inputs before and hence
+        does not need to be rendered again.
+
+        """
+        rkey = None
+        if layout is not None and ckey is not None:
+            attrs = repr(sorted(page.items()))
+            rkey = sha1(self.new["stamp"], layout, attrs, page.html)
+        rel = os.path.relpath(dst, dir_out)
+        self.new["pages"][page.url] = {"ckey": ckey, "rkey": rkey, "out": rel}
+        entry = self.old.get("pages", {}).get(page.url)
+        return (rkey is not None and entry is not None and
+                entry["rkey"] == rkey and entry["out"] == rel and opx(dst))
+
+    def asset_done(self, src, dst, dir_out):
+        """Record an asset and check if its copy `dst` is up to date."""
+
+        st = os.stat(src)
+        sig = [st.st_size, st.st_mtime]
+        rel = os.path.relpath(dst, dir_out)
+        self.new["assets"][rel] = sig
+        return self.old.get("assets", {}).get(rel) == sig and opx(dst)
+
+    def conversion_done(self, dst, key, dir_out):
+        """Record a conversion and check if its output `dst` is up to date.
+
+        `key` covers the inputs of the conversion (see `conversion_key()`).
+
+        """
+        rel = os.path.relpath(dst, dir_out)
+        self.new["converted"][rel] = key
+        return self.old.get("converted", {}).get(rel) == key and opx(dst)
+
+    def output_done(self, dst, dir_out):
+        """Record an additional output file, e.g. a fingerprinted copy."""
+
+        self.new["assets"][os.path.relpath(dst, dir_out)] = None
+
+    def dir_done(self, dst, dir_out):
+        """Record an output directory."""
+
+        self.new["dirs"].append(os.path.relpath(dst, dir_out))
+
+    def prune(self, dir_out):
+        """Remove outputs of the previous build not produced anymore."""
+
+        new = set(e["out"] for e in self.new["pages"].values())
+        new.update(self.new["assets"])
+        new.update(self.new["converted"])
+        old = set(e["out"] for e in self.old.get("pages", {}).values())
+        old.update(self.old.get("assets", {}))
+        old.update(self.old.get("converted", {}))
+        for rel in sorted(old - new):
+            for fname in (opj(dir_out, rel), opj(dir_out, "%s.gz" % rel)):
+                if opx(fname):
+                    print("info   : prune %s" % fname)
+                    os.remove(fname)
+        urls = set(self.new["pages"])
+        for url in set(self.old.get("pages", {})) - urls:
+            fname = opj(self.dir, "html", "%s.html" % sha1(url))
+            if opx(fname):
+                os.remove(fname)
+        dirs = set(self.old.get("dirs", [])) - set(self.new["dirs"])
+        for rel in sorted(dirs, reverse=True):
+            fname = opj(dir_out, rel)
+            if opx(fname) and not os.listdir(fname):
+                print("info   : prune %s" % fname)
+                os.rmdir(fname)
+
+    def save(self):
+        """Write the manifest of the current build."""
+
+        if not opx(self.dir):
+            os.makedirs(self.dir)
+        tmp = "%s.tmp" % self.fname
+        with open(tmp, 'w') as fp:
+            json.dump(self.new, fp)
+        os.rename(tmp, self.fname)
+
+# -----------------------------------------------------------------------------
+
+def incremental_hook(*attrs, **kwargs):
+    """Decorator for hooks which only need to process changed pages.
+
+    Instead of no arguments, a decorated hook gets a `Changes` object telling
+    which pages have been added, modified or removed since the hook ran last.
+    Pages count as modified if any of the attributes named by `attrs` changed
+    (`html` and `source` refer to a page's HTML and source), or any attribute
+    at all if no names are given. In incremental builds, a hook is skipped if
+    there are no changes, unless `always=True` is given (e.g. because the hook
+    creates virtual pages, which have to be created in every build).
+
+    """
+    always = kwargs.pop("always", False)
+    if kwargs:
+        raise TypeError("unexpected arguments: %s" % ", ".join(kwargs))
+
+    def decorate(func):
+        func.incremental = (attrs, always)
+        return func
+
+    return decorate
+
+class Changes(object):
+    """Pages changed since an incremental hook ran last.
+
+    `added` and `modified` are lists of pages, `removed` is a list of URLs.
+    `state` is a dictionary the hook may use to keep data (anything which can
+    be stored as JSON) until the next build.
+
+    """
+    def __init__(self, added, modified, removed, state):
+
+        self.added = added
+        self.modified = modified
+        self.removed = removed
+        self.state = state
+
+    def __nonzero__(self):
+        return bool(self.added or self.modified or self.removed)
+
+class HookState(object):
+    """Persistent state of incremental hooks, kept in `.poole/hooks.json`.
+
+    For every hook decorated by `incremental_hook()`, this records a key over
+    the relevant attributes of each page and the hook's own `state`. The
+    previous build's state is only used by incremental builds and only if
+    `macros.py` did not change -- otherwise all pages count as added.
+
+    """
+    def __init__(self, project, stamp, incremental):
+
+        self.fname = opj(project, ".poole", "hooks.json")
+        self.stamp = stamp
+        self.old = {}
+        self.new = {}
+        if incremental and opx(self.fname):
+            try:
+                with open(self.fname) as fp:
+                    self.old = json.load(fp)
+            except ValueError:
+                print("warning: ignoring corrupt hook state %s" % self.fname)
+            if self.old.get("stamp") != stamp:
+                self.old = {}
+
+    def _key(self, page, attrs):
+        if not attrs:
+            return sha1(repr(sorted(page.items())))
+        return sha1(*[page.html if a == "html" else page.source
+                      if a == "source" else repr(page.get(a)) for a in attrs])
+
+    def changes(self, name, pages, attrs):
+        """Get the changes of `pages` since hook `name` ran last."""
+
+        entry = self.old.get("hooks", {}).get(name, {})
+        old = entry.get("pages", {})
+        keys = dict((p.url, self._key(p, attrs)) for p in pages)
+        added = [p for p in pages if p.url not in old]
+        modified = [p for p in pages if p.url in old and
+                    old[p.url] != keys[p.url]]
+        removed = sorted(set(old) - set(keys))
+        changes = Changes(added, modified, removed, entry.get("state", {}))
+        self.new[name] = (keys, changes)
+        return changes
+
+    def save(self):
+        """Save the state of all hooks which ran in the current build."""
+
+        if not self.old and not self.new:
+            return
+        hooks = dict(self.old.get("hooks", {}))
+        for name, (keys, changes) in self.new.items():
+            hooks[name] = {"pages": keys, "state": changes.state}
+        if not opx(os.path.dirname(self.fname)):
+            os.makedirs(os.path.dirname(self.fname))
+        tmp = "%s.tmp" % self.fname
+        with open(tmp, 'w') as fp:
+            json.dump({"stamp": self.stamp, "hooks": hooks}, fp)
+        os.rename(tmp, self.fname)
+
+# -----------------------------------------------------------------------------
+
+MD_EXTENSIONS = [
+    'markdown.extensions.fenced_code',
+    'markdown.extensions.tables',
+    'markdown.extensions.admonition',
+]
+
+def markdown_backend(extensions):
+    """Converter backend based on Python-Markdown.
+
+    Loading extensions is expensive, so there is only one `Markdown` instance
+    which gets reset before converting a page.
+
+    """
+    import markdown
+
+    md = markdown.Markdown(extensions=extensions)
+    return lambda text: md.reset().convert(text)
+
+# Markdown converter backends: callables which get a list of extension names
+# and return a function converting markdown text to HTML. Sites may choose a
+# backend by setting `converter_backend` in `macros.py` to one of the names
+# below or to a backend callable.
+CONVERTER_BACKENDS = {
+    "markdown": markdown_backend,
+}
+
+_converters = {} # converters of named backends, kept across builds
+
+def md_converter(backend, extensions):
+    """Get a markdown converter function from a backend name or callable."""
+
+    if callable(backend):
+        return backend(extensions)
+    if backend not in CONVERTER_BACKENDS:
+        print("abort  : unknown converter backend %r (choices: %s)" %
+              (backend, ", ".join(sorted(CONVERTER_BACKENDS))))
+        sys.exit(1)
+    key = (backend, CONVERTER_BACKENDS[backend], tuple(extensions))
+    if key not in _converters:
+        _converters[key] = CONVERTER_BACKENDS[backend](extensions)
+    return _converters[key]
+
+class MarkdownCache(object):
+    """Persistent cache of converted markdown, addressed by content.
+
+    Entries are keyed by the markdown text to convert and a *salt* covering
+    anything else affecting the conversion (backend, extensions, library
+    version). Hence a cache directory may be shared by several projects and
+    entries never get stale -- they only get evicted, least recently used
+    first, when the cache grows beyond `limit` bytes.
+
+    The size of the cache is recorded in a file `size` in the cache directory
+    and increased by the size of entries written by a build, so the cache
+    only needs to be scanned when it may have grown beyond its limit.
+
+    """
+    def __init__(self, dirname, limit, *salt):
+
+        self.dir = dirname
+        self.limit = limit
+        self.salt = sha1(*salt)
+        self.size_fname = opj(dirname, "size")
+
+    def _fname(self, text):
+        key = sha1(self.salt, text)
+        return opj(self.dir, key[:2], "%s.html" % key)
+
+    def wrap(self, convert):
+        """Get a version of a converter function which uses the cache."""
+
+        def cached(text):
+            fname = self._fname(text)
+            try:
+                with codecs.open(fname, 'r', 'utf-8') as fp:
+                    html = fp.read()
+            except IOError:
+                pass
+            else:
+                count("markdown cache hits")
+                os.utime(fname, None) # mark as recently used
+                return html
+            count("markdown cache misses")
+            html = convert(text)
+            if not opx(os.path.dirname(fname)):
+                try:
+                    os.makedirs(os.path.dirname(fname))
+                except OSError: # created meanwhile by another process
+                    pass
+            tmp = "%s.%d.tmp" % (fname, os.getpid())
+            with codecs.open(tmp, 'w', 'utf-8') as fp:
+                fp.write(html)
+            count("markdown cache bytes written", os.path.getsize(tmp))
+            os.rename(tmp, fname)
+            return html
+
+        return cached
+
+    def evict(self):
+        """Remove least recently used entries to fit the cache's limit.
+
+        Call this at the end of a build, the cache is only scanned if its
+        recorded size plus the entries written by the build exceed the limit.
+
+        """
+        try:
+            with open(self.size_fname) as fp:
+                recorded = size = int(fp.read())
+        except (IOError, ValueError): # not recorded yet or broken
+            recorded = size = None
+        if size is not None:
+            size += _counters.get("markdown cache bytes written", 0)
+        if size is None or size > self.limit:
+            entries, size = [], 0
+            for cwd, dirs, files in os.walk(self.dir):
+                for f in files:
+                    fname = opj(cwd, f)
+                    if fname == self.size_fname:
+                        continue
+                    st = os.stat(fname)
+                    entries.append((st.st_mtime, st.st_size, fname))
+                    size += st.st_size
+            entries.sort()
+            while size > self.limit:
+                _, fsize, fname = entries.pop(0)
+                os.remove(fname)
+                size -= fsize
+        if size == recorded or not opx(self.dir):
+            return
+        tmp = "%s.%d.tmp" % (self.size_fname, os.getpid())
+        with open(tmp, 'w') as fp:
+            fp.write(str(size))
+        os.rename(tmp, self.size_fname)
+
+# -----------------------------------------------------------------------------
+
+_counters = {} # build statistics, also collected from worker processes
+
+def count(name, n=1):
+    """Increment a build statistics counter."""
+
+    _counters[name] = _counters.get(name, 0) + n
+
+_timings = None # profiling records, also collected from worker processes
+
+def timing(kind, name, seconds, **info):
+    """Record a profiling measurement, if profiling is enabled.
+
+    `kind` is one of "phase", "hook", "parse", "convert", "render", "eval"
+    or "exec", `info` holds kind-specific details.
+
+    """
+    if _timings is not None:
+        info.update(kind=kind, name=name, seconds=seconds)
+        _timings.append(info)
+
+def peak_memory():
+    """Peak memory usage of this process and its children in KiB.
+
+    Returns `None` if this is not available on the current platform.
+
+    """
+    if resource is None:
+        return None
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return peak // 1024 if sys.platform == "darwin" else peak # bytes on OS X
+
+PROFILE_TOP = 10 # number of slowest items per category to print
+
+def profile_report(fname, records, seconds):
+    """Write profiling records as a JSON report and print a summary."""
+
+    report = {"poole": __version__, "seconds": seconds,
+              "peak_memory": peak_memory(), "phases": [], "hooks": [],
+              "pages": [], "blocks": []}
+    pages = {}
+    for rec in records:
+        kind = rec["kind"]
+        if kind == "phase":
+            report["phases"].append(rec)
+        elif kind == "hook":
+            report["hooks"].append(rec)
+        elif kind in ("eval", "exec"):
+            report["blocks"].append(rec)
+        else: # parse, convert or render
+            page = pages.setdefault(rec["name"], {"url": rec["name"],
+                                                  "seconds": 0})
+            page[kind] = rec["seconds"]
+            page["seconds"] += rec["seconds"]
+    report["pages"] = sorted(pages.values(), key=lambda p: p["url"])
+
+    with open(fname, 'w') as fp:
+        json.dump(report, fp, indent=1, sort_keys=True)
+
+    def aggregate(recs, label):
+        totals, runs = {}, {}
+        for rec in recs:
+            key = label(rec)
+            totals[key] = totals.get(key, 0) + rec["seconds"]
+            runs[key] = runs.get(key, 0) + 1
+        return [(t, "%s (%d runs)" % (k, runs[k]) if runs[k] > 1 else k)
+                for k, t in totals.items()]
+
+    print("info   : build profile written to %s" % fname)
+    print("info   : total: %.3fs, peak memory: %s KiB" % (
+          seconds, report["peak_memory"]))
+    summary = [
+        ("phases", [(r["seconds"], r["name"]) for r in report["phases"]]),
+        ("hooks", aggregate(report["hooks"], lambda r: r["name"])),
+        ("pages", [(p["seconds"], p["url"]) for p in report["pages"]]),
+        ("code blocks", aggregate(report["blocks"], lambda r: "%s at %s:%s" %
+                                  (r["kind"], r["name"], r["line"]))),
+    ]
+    for title, rows in summary:
+        if rows:
+            print("info   : slowest %s:" % title)
+        for secs, name in sorted(rows, reverse=True)[:PROFILE_TOP]:
+            print("info   : %9.3fs  %s" % (secs, name))
+
+_pool_job = None # (function, items) inherited by forked pool workers
+
+def _pool_call(i):
+    """Apply the current pool job's function on its `i`-th item.
+
+    Returns the result as well as the statistics counted and the profiling
+    records taken meanwhile.
+
+    """
+    func, items = _pool_job
+    _counters.clear()
+    if _timings is not None:
+        del _timings[:]
+    try:
+        return func(items[i]), dict(_counters), _timings
+    except SystemExit:
+        # don't let an abort kill the worker (the pool would hang)
+        return _pool_call, None, None
+
+def pmap(func, items, jobs):
+    """Map `func` on `items` using up to `jobs` worker processes.
+
+    Workers are forked, hence `func` may be any callable (e.g. a closure) and
+    sees the state of the parent process at the time `pmap` is called. Results,
+    statistics (see `count()`) and profiling records (see `timing()`) are
+    passed back to the parent, any other side effects of `func` are lost.
+    Without `os.fork()` (i.e. on Windows) items are processed serially.
+
+    """
+    return pstart(func, items, jobs)()
+
+def pstart(func, items, jobs):
+    """Like `pmap()`, but return while workers are busy.
+
+    Returns a function which waits for the workers and returns the results.
+    If items are processed serially, this happens before `pstart` returns.
+
+    """
+    global _pool_job
+
+    if jobs < 2 or len(items) < 2 or not hasattr(os, "fork"):
+        results = [func(x) for x in items]
+        return lambda: results
+
+    import multiprocessing
+
+    sys.stdout.flush()
+    _pool_job = (func, items)
+    try:
+        pool = multiprocessing.Pool(min(jobs, len(items)))
+    finally:
+        _pool_job = None # forked workers have their own copy
+    pending = pool.map_async(_pool_call, range(len(items)))
+
+    def wait():
+        try:
+            results = pending.get()
+        finally:
+            pool.close()
+            pool.join()
+
+        if any(result is _pool_call for result, _, _ in results):
+            sys.exit(1) # a worker aborted, it already told why
+
+        for _, counters, timings in results:
+            for name, n in counters.items():
+                count(name, n)
+            if _timings is not None:
+                _timings.extend(timings)
+
+        return [result for result, _, _ in results]
+
+    return wait
+
+# -----------------------------------------------------------------------------
+
+class Converters(object):
+    """Dispatch table of the custom converters defined in `macros.py`.
+
+    Converters are given as a dictionary mapping file name patterns to tuples
+    of a converter function, the extension of converted files and optionally
+    a list of files (glob patterns relative to the input folder) converted
+    files depend on, e.g. files included by the converted file.
+
+    """
+    def __init__(self, converters, dir_in):
+
+        self._dir_in = dir_in
+        self._table = []
+        for patt, conv in converters.items():
+            deps = conv[2] if len(conv) > 2 else ()
+            self._table.append((re.compile(patt), conv[0], conv[1], deps))
+
+        # a single regex to quickly check if any converter matches, unless
+        # patterns would interfere with each other in a combined regex
+        self._any = None
+        if all(not r.groups and not r.flags for r, _, _, _ in self._table):
+            self._any = re.compile("|".join(
+                "(?:%s)" % r.pattern for r, _, _, _ in self._table) or "(?!)")
+
+    def job(self, src, dst):
+        """Get the conversion job for an input file.
+
+        `dst` is the name of the file in the output folder, its extension gets
+        replaced by the one of the converter. Jobs are tuples of the converter
+        function, `src`, the converted file name and the files it depends on.
+        Returns `None` if there is no matching converter.
+
+        """
+        name = os.path.basename(src)
+        if self._any is not None and not self._any.search(name):
+            return None
+        for regx, func, ext, deps in self._table:
+            if regx.search(name):
+                dst = '%s.%s' % (os.path.splitext(dst)[0], ext)
+                return func, src, dst, self._files(deps)
+        return None
+
+    def _files(self, patterns):
+
+        fnames = set()
+        for patt in patterns:
+            fnames.update(glob.glob(opj(self._dir_in, patt)))
+        return sorted(fnames)
+
+    def is_dependency(self, fname):
+        """Check if any converter depends on the given file."""
+
+        fname = os.path.abspath(fname)
+        return any(fname == os.path.abspath(dep)
+                   for _, _, _, deps in self._table
+                   for dep in self._files(deps))
+
+def convert_asset(job):
+    """Run a conversion job (see `Converters.job()`)."""
+
+    func, src, dst, _ = job
+    print('info   : convert %s (%s)' % (src, func.__name__))
+    func(src, dst)
+
+def conversion_key(job, macros_src):
+    """Key over the inputs of a conversion job.
+
+    `macros_src` is the source of `macros.py`, which defines the converter.
+
+    """
+    func, src, _, deps = job
+    parts = [macros_src, func.__name__]
+    for fname in [src] + deps:
+        with open(fname, 'rb') as fp:
+            parts.extend((fname, fp.read()))
+    return sha1(*parts)
+
+def copy_asset(src, dst):
+    """Copy an input file to the output folder, unless it is there already.
+
+    Returns true if the file has been copied.
+
+    """
+    if opx(dst) and os.path.getsize(src) == os.path.getsize(dst) and \
+       filecmp.cmp(src, dst, shallow=False):
+        return False
+    tmp = "%s.%d.tmp" % (dst, os.getpid())
+    shutil.copyfile(src, tmp)
+    try:
+        shutil.copymode(src, tmp)
+    except OSError: # some filesystems like FAT won't allow this
+        pass
+    replace_file(tmp, dst)
+    return True
+
+def replace_file(src, dst):
+    """Rename `src` to `dst`, atomically where the platform supports it."""
+
+    if os.name == "nt" and opx(dst): # rename does not replace on Windows
+        os.remove(dst)
+    os.rename(src, dst)
+
+# -----------------------------------------------------------------------------
+
+WRITE_THREADS = 4 # threads writing output files in the background
+
+class OutputWriter(object):
+    """Write files to the output folder and keep track of changes.
+
+    Files get written to a temporary file first and then renamed, so readers
+    of the output folder never see half-written files. Files which already
+    have the content to write are not touched at all, i.e. they keep their
+    modification time. Writing happens in background threads, except when
+    called from a worker process (see `pmap()`), which writes directly.
+
+    The writer takes a snapshot of the output folder when created, without
+    hidden files. Full builds use it to remove files of previous builds which
+    have not been produced again (see `keep()`), and `report()` compares it
+    with the output folder at the end of a build to tell which files have
+    been added, changed or deleted.
+
+    """
+    def __init__(self, dir_out, enc, threads=WRITE_THREADS):
+
+        self.enc = enc # file name encoding
+        self.dir = self._name(dir_out)
+        self.start = time.time()
+        self.before = self._snapshot()
+        self.kept = set()
+        self.pid = os.getpid()
+        self.queue = Queue.Queue(threads * 16)
+        self.errors = []
+        self.threads = []
+        for _ in range(threads):
+            thread = threading.Thread(target=self._work)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def _name(self, fname):
+        return fname.decode(self.enc) if isinstance(fname, str) else fname
+
+    def _snapshot(self):
+        """Get size and modification time of all files in the output folder.
+
+        Hidden files and folders (e.g. `.git` of a checkout of a site's
+        repository) are not included, so they are never pruned.
+
+        """
+        snapshot = {}
+        for cwd, dirs, files in os.walk(self.dir):
+            dirs[:] = [d for d in dirs if not d.startswith(".")]
+            for f in files:
+                if f.startswith("."):
+                    continue
+                st = os.stat(opj(cwd, f))
+                snapshot[opj(cwd, f)] = (st.st_size, st.st_mtime)
+        return snapshot
+
+    def _work(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                break
+            try:
+                self._write(*job)
+            except EnvironmentError as e:
+                self.errors.append(e)
+
+    def _write(self, fname, data):
+        if opx(fname) and os.path.getsize(fname) == len(data):
+            with open(fname, 'rb') as fp:
+                if fp.read() == data:
+                    return
+        tmp = "%s.%d.tmp" % (fname, os.getpid())
+        with open(tmp, 'wb') as fp:
+            fp.write(data)
+        replace_file(tmp, fname)
+
+    def write(self, fname, data):
+        """Write a byte string to a file, unless it has this content already."""
+
+        if os.getpid() != self.pid or not self.threads:
+            self._write(fname, data)
+        else:
+            self.queue.put((fname, data))
+
+    def keep(self, fname):
+        """Mark a file as output of the current build (whether written or not).
+
+        Files the build wrote itself don't need to be marked, this is only
+        for files which have been left untouched because they are up to date.
+
+        """
+        self.kept.add(self._name(fname))
+
+    def stop(self):
+        """Write pending files and stop the writer threads."""
+
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def wait(self):
+        """Wait until all files have been written."""
+
+        self.stop()
+        if self.errors:
+            print("abort  : failed to write output: %s" % self.errors[0])
+            sys.exit(1)
+
+    def prune(self, gzipped=False):
+        """Remove files of previous builds which have not been produced again.
+
+        If `gzipped` is true, gzipped copies of remaining files are kept (to
+        be updated by `precompress()`). Directories left empty get removed
+        too, unless they have been kept.
+
+        """
+        stale = set()
+        for fname, stamp in self.before.items():
+            if fname in self.kept or not opx(fname):
+                continue
+            st = os.stat(fname)
+            if (st.st_size, st.st_mtime) == stamp and st.st_mtime < self.start:
+                stale.add(fname) # else written by this build, e.g. by a hook
+        dirs = set()
+        for fname in sorted(stale):
+            if gzipped and fname.endswith(".gz") and fname[:-3] not in stale \
+               and opx(fname[:-3]):
+                continue
+            os.remove(fname)
+            dirs.add(os.path.dirname(fname))
+        while dirs:
+            dname = max(dirs, key=len)
+            dirs.discard(dname)
+            if dname != self.dir and dname not in self.kept and \
+               not os.listdir(dname):
+                os.rmdir(dname)
+                dirs.add(os.path.dirname(dname))
+
+    def report(self, fname):
+        """Write a JSON file listing the added, changed and deleted files.
+
+        File names are relative to the output folder and use slashes.
+
+        """
+        after = self._snapshot()
+        rel = lambda f: os.path.relpath(f, self.dir).replace(os.path.sep, "/")
+        changes = {
+            "added": sorted(rel(f) for f in after if f not in self.before),
+            "changed": sorted(rel(f) for f in after if f in self.before and
+                              after[f] != self.before[f]),
+            "deleted": sorted(rel(f) for f in self.before if f not in after),
+        }
+        if not opx(os.path.dirname(fname)):
+            os.makedirs(os.path.dirname(fname))
+        with open(fname, 'w') as fp:
+            json.dump(changes, fp, indent=1, sort_keys=True)
+        print("info   : output: %d added, %d changed, %d deleted" % tuple(
+              len(changes[k]) for k in ("added", "changed", "deleted")))
+
+# -----------------------------------------------------------------------------
+
+GZIP_PATT = r'\.(?:html?|css|js|svg|json|xml|txt)$'
+GZIP_MIN_SIZE = 256 # smaller files are not worth compressing
+
+def gzip_file(fname):
+    """Write a gzipped copy of a file, unless there is an up-to-date one.
+
+    Returns true if the file has been compressed.
+
+    """
+    fgz = "%s.gz" % fname
+    if opx(fgz) and os.path.getmtime(fgz) >= os.path.getmtime(fname):
+        return False
+    with open(fname, 'rb') as fp:
+        data = fp.read()
+    zobj = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    with open("%s.tmp" % fgz, 'wb') as fp:
+        fp.write(zobj.compress(data))
+        fp.write(zobj.flush())
+    os.rename("%s.tmp" % fgz, fgz)
+    return True
+
+def precompress(dir_out, jobs):
+    """Write gzipped copies of text files in the output folder.
+
+    Static web servers may send these instead of compressing files on every
+    request.
+
+    """
+    fnames = []
+    for cwd, dirs, files in os.walk(dir_out):
+        for f in files:
+            fname = opj(cwd, f)
+            if re.search(GZIP_PATT, f) and \
+               os.path.getsize(fname) >= GZIP_MIN_SIZE:
+                fnames.append(fname)
+    done = sum(pmap(gzip_file, fnames, jobs))
+    print("info   : precompressed %d of %d files" % (done, len(fnames)))
+
+# -----------------------------------------------------------------------------
+
+FINGERPRINT_PATT = (r'\.(?:css|js|png|jpe?g|gif|svg|webp|ico|bmp|woff2?|ttf|'
+                    r'otf|eot)$')
+
+def fingerprint(fname):
+    """Write a copy of a file with a hash of its content in its name.
+
+    Returns the name of the copy, e.g. `style.0123456789.css` for `style.css`.
+
+    """
+    with open(fname, 'rb') as fp:
+        digest = hashlib.sha1(fp.read()).hexdigest()[:10]
+    root, ext = os.path.splitext(fname)
+    hashed = "%s.%s%s" % (root, digest, ext)
+    if not opx(hashed):
+        shutil.copyfile(fname, hashed)
+    return hashed
+
+# -----------------------------------------------------------------------------
+
+SHARD_MANIFEST = ".poole-shard.json" # lists the files built by a shard
+
+def in_shard(key, shard):
+    """Check if a page URL or asset path belongs to a shard `(i, n)`.
+
+    Assignment only depends on `key`, so it is the same on any machine and
+    does not change when other pages or assets get added or removed.
+
+    """
+    if shard is None:
+        return True
+    i, n = shard
+    return int(sha1(key), 16) % n == i - 1
+
+def shard_manifest(dir_out, shard):
+    """Write the manifest of a shard's output folder, used by `merge()`."""
+
+    files = {}
+    for cwd, dirs, fnames in os.walk(dir_out):
+        dirs[:] = [d for d in dirs if not d.startswith(".")]
+        for f in fnames:
+            if f.startswith("."): # like the shard manifest itself
+                continue
+            fname = opj(cwd, f)
+            rel = os.path.relpath(fname, dir_out).replace(os.sep, "/")
+            with open(fname, 'rb') as fp:
+                files[rel] = hashlib.sha1(fp.read()).hexdigest()
+    with open(opj(dir_out, SHARD_MANIFEST), 'w') as fp:
+        json.dump({"shard": shard[0], "shards": shard[1], "files": files}, fp,
+                  indent=0, sort_keys=True)
+    print("info   : shard %d/%d built %d files" % (shard + (len(files),)))
+
+# -----------------------------------------------------------------------------
+
+SITEMAP_MAX_URLS = 50000 # limits of the sitemap protocol
+SITEMAP_MAX_BYTES = 50 * 1024 * 1024
+FEED_SIZE = 20 # default number of posts in a feed
+
+def xmlx(s):
+    """Escape a string for use in XML text and attribute values."""
+
+    return s.replace("&", "&amp;").replace("<", "&lt;").replace(
+        ">", "&gt;").replace('"', "&quot;")
+
+def w3c_date(date):
+    """Get the `YYYY-MM-DD` part of a date attribute (or `None`)."""
+
+    m = re.match(r'(\d{4}-\d{2}-\d{2})', date or "")
+    return m and m.group(1)
+
+def _open_xml(fname):
+    fp = open("%s.%d.tmp" % (fname, os.getpid()), 'wb')
+    fp.write('<?xml version="1.0" encoding="utf-8"?>\n')
+    return fp
+
+def _close_xml(fp, fname):
+    fp.close()
+    replace_file(fp.name, fname)
+
+def write_sitemap(entries, dir_out, site_url):
+    """Write a sitemap for a sequence of `(url, lastmod)` tuples.
+
+    URLs are relative to `site_url`, `lastmod` is a W3C date or `None`.
+    Entries are written as they come. If there are more than the sitemap
+    protocol allows for one file, they are split into several files and
+    `sitemap.xml` becomes a sitemap index. Returns the names of all files.
+
+    """
+    head = '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+    tail = '</urlset>\n'
+    fnames, fp = [], None
+    for url, lastmod in entries:
+        entry = "<url><loc>%s</loc>%s</url>\n" % (xmlx(site_url + url),
+            lastmod and "<lastmod>%s</lastmod>" % lastmod or "")
+        entry = entry.encode("utf-8")
+        if fp is None or n == SITEMAP_MAX_URLS or \
+           size + len(entry) + len(tail) > SITEMAP_MAX_BYTES:
+            if fp is not None:
+                fp.write(tail)
+                _close_xml(fp, fnames[-1])
+            fnames.append(opj(dir_out, "sitemap-%d.xml" % (len(fnames) + 1)))
+            fp = _open_xml(fnames[-1])
+            fp.write(head)
+            n, size = 0, fp.tell()
+        fp.write(entry)
+        n += 1
+        size += len(entry)
+    if fp is None: # no pages
+        fnames.append(opj(dir_out, "sitemap-1.xml"))
+        fp = _open_xml(fnames[-1])
+        fp.write(head)
+    fp.write(tail)
+    _close_xml(fp, fnames[-1])
+
+    index = opj(dir_out, "sitemap.xml")
+    if len(fnames) == 1:
+        replace_file(fnames[0], index)
+        return [index]
+    fp = _open_xml(index)
+    fp.write('<sitemapindex '
+             'xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n')
+    for fname in fnames:
+        fp.write("<sitemap><loc>%s</loc></sitemap>\n" %
+                 xmlx(site_url + os.path.basename(fname)))
+    fp.write("</sitemapindex>\n")
+    _close_xml(fp, index)
+    return [index] + fnames
+
+def write_feed(fmt, posts, fname, site_url, settings):
+    """Write an Atom or RSS feed (`fmt`) of posts, newest first.
+
+    Posts are pages with a `date` attribute, their HTML is the content of
+    feed entries and their `post` attribute (or `title`) the entry title.
+    `settings` may give the feed's `title` and `author`.
+
+    """
+    import calendar
+    import email.utils
+
+    def rfc822(date):
+        y, m, d = [int(x) for x in w3c_date(date).split("-")]
+        return email.utils.formatdate(calendar.timegm((y, m, d, 0, 0, 0)),
+                                      usegmt=True)
+
+    title = xmlx(settings.get("title", site_url))
+    author = xmlx(settings.get("author", settings.get("title", site_url)))
+    fp = _open_xml(fname)
+    if fmt == "atom":
+        updated = w3c_date(posts[0]["date"]) if posts else "1970-01-01"
+        fp.write('<feed xmlns="http://www.w3.org/2005/Atom">\n'
+                 '<title>%s</title>\n<id>%s</id>\n'
+                 '<link href="%s"/>\n<link rel="self" href="%s"/>\n'
+                 '<updated>%sT00:00:00Z</updated>\n'
+                 '<author><name>%s</name></author>\n' % (title,
+                 xmlx(site_url), xmlx(site_url),
+                 xmlx(site_url + os.path.basename(fname)), updated, author))
+    else:
+        fp.write('<rss version="2.0">\n<channel>\n<title>%s</title>\n'
+                 '<link>%s</link>\n<description>%s</description>\n' % (
+                 title, xmlx(site_url), title))
+    for page in posts:
+        url = xmlx(site_url + page.url)
+        # `title` of posts defaults to the file name prefix, e.g. "blog"
+        ptitle = xmlx(page.get("post") or page["title"])
+        if fmt == "atom":
+            entry = ('<entry>\n<title>%s</title>\n<id>%s</id>\n'
+                     '<link href="%s"/>\n<updated>%sT00:00:00Z</updated>\n'
+                     '<content type="html">%s</content>\n</entry>\n' % (
+                     ptitle, url, url, w3c_date(page["date"]),
+                     xmlx(page.html)))
+        else:
+            entry = ('<item>\n<title>%s</title>\n<link>%s</link>\n'
+                     '<guid>%s</guid>\n<pubDate>%s</pubDate>\n'
+                     '<description>%s</description>\n</item>\n' % (
+                     ptitle, url, url, rfc822(page["date"]),
+                     xmlx(page.html)))
+        fp.write(entry.encode("utf-8"))
+    fp.write('</feed>\n' if fmt == "atom" else '</channel>\n</rss>\n')
+    _close_xml(fp, fname)
+
+class FeedState(object):
+    """Keys and files of the sitemap and feeds written by previous builds.
+
+    A key covers all page attributes a sitemap or feed is made of. If it did
+    not change, neither did the files. Files written by a previous build
+    but not by the current one get removed when saving the state.
+
+    """
+    def __init__(self, project, dir_out):
+
+        self.fname = opj(project, ".poole", "feeds.json")
+        self.dir = dir_out
+        self.old, self.new = {}, {}
+        if opx(self.fname):
+            with open(self.fname) as fp:
+                self.old = json.load(fp)
+
+    def fresh(self, name, key):
+        """Get the files of `name` if they have been written from `key`."""
+
+        entry = self.old.get(name)
+        if entry is None or entry["key"] != key:
+            return None
+        fnames = [opj(self.dir, f) for f in entry["files"]]
+        if not all(opx(f) for f in fnames):
+            return None
+        self.new[name] = entry
+        return fnames
+
+    def done(self, name, key, fnames):
+        """Record the files of `name` written from `key`."""
+
+        self.new[name] = {"key": key, "files": [
+            os.path.relpath(f, self.dir) for f in fnames]}
+
+    def save(self):
+        """Save the state, remove files which have not been written again."""
+
+        old = set(f for e in self.old.values() for f in e["files"])
+        new = set(f for e in self.new.values() for f in e["files"])
+        for rel in sorted(old - new):
+            if opx(opj(self.dir, rel)):
+                print("info   : prune %s" % opj(self.dir, rel))
+                os.remove(opj(self.dir, rel))
+        if not self.old and not self.new:
+            return
+        with open(self.fname, 'w') as fp:
+            json.dump(self.new, fp, indent=1, sort_keys=True)
+
+# -----------------------------------------------------------------------------
+
+SEARCH_PREFIX = 2 # length of the word prefixes search index shards are named by
+
+_re_markup = re.compile(r'<(script|style)\b.*?</\1\s*>|<[^>]*>', re.S | re.I)
+_re_word = re.compile(r'\w\w+', re.U)
+
+def page_words(html):
+    """Count the words in the text of an HTML document."""
+
+    import HTMLParser
+
+    text = HTMLParser.HTMLParser().unescape(_re_markup.sub(" ", html))
+    counts = {}
+    for word in _re_word.findall(text.lower()):
+        counts[word] = counts.get(word, 0) + 1
+    return counts
+
+def search_shard(word):
+    """Name of the search index shard containing `word`.
+
+    This is the word's prefix, with characters other than `a-z` and `0-9`
+    replaced by `_` and their hexadecimal code point (e.g. `_e9` for `é`).
+
+    """
+    return "".join(c if "a" <= c <= "z" or "0" <= c <= "9" else "_%x" % ord(c)
+                   for c in word[:SEARCH_PREFIX])
+
+class SearchIndex(object):
+    """Inverted index of the words in pages, split into shards by prefix.
+
+    The index is written to a folder with a file `docs.json`, listing the URL
+    and title of each indexed page by document number, and a file per word
+    prefix (see `search_shard()`) mapping words to lists of document numbers
+    and counts (`[doc, count, doc, count, ...]`). Document numbers of pages
+    don't change between builds.
+
+    Word counts of pages are kept in `.poole/search.json` along with a hash
+    of the page's HTML, so only pages whose HTML changed get indexed again.
+
+    """
+    def __init__(self, project, dirname):
+
+        self.fname = opj(project, ".poole", "search.json")
+        self.dir = dirname
+        self.state = {"ids": {}, "pages": {}}
+        self.digests = {}
+        if opx(self.fname):
+            try:
+                with open(self.fname) as fp:
+                    self.state = json.load(fp)
+            except ValueError:
+                print("warning: ignoring corrupt search index state %s" %
+                      self.fname)
+
+    def todo(self, pages):
+        """Get the pages whose HTML changed since they have been indexed."""
+
+        todo = []
+        for page in pages:
+            digest = self.digests[page.url] = sha1(page.html)
+            entry = self.state["pages"].get(page.url)
+            if entry is None or entry[0] != digest:
+                todo.append(page)
+        return todo
+
+    def update(self, pages, words):
+        """Set the word counts of pages returned by `todo()`."""
+
+        for page, counts in zip(pages, words):
+            self.state["pages"][page.url] = [self.digests[page.url], counts]
+
+    def write(self, pages, writer):
+        """Write the index of `pages` using an `OutputWriter`."""
+
+        ids, entries = self.state["ids"], self.state["pages"]
+        urls = set(p.url for p in pages)
+        for url in list(entries):
+            if url not in urls:
+                del entries[url]
+                ids.pop(url, None)
+        pages = sorted(pages, key=lambda p: p.url)
+        n = max(ids.values()) + 1 if ids else 0
+        for page in pages:
+            if page.url not in ids:
+                ids[page.url], n = n, n + 1
+
+        docs, shards = [None] * n, {}
+        for page in sorted(pages, key=lambda p: ids[p.url]):
+            doc = ids[page.url]
+            docs[doc] = [page.url, page["title"]]
+            for word, count in entries[page.url][1].items():
+                shard = shards.setdefault(search_shard(word), {})
+                shard.setdefault(word, []).extend((doc, count))
+
+        words = sum(len(shard) for shard in shards.values())
+        if not opx(self.dir):
+            os.makedirs(self.dir)
+        shards["docs"] = docs
+        fnames = set()
+        for name, data in shards.items():
+            fname = opj(self.dir, "%s.json" % name)
+            writer.write(fname, json.dumps(data, separators=(",", ":"),
+                                           sort_keys=True))
+            writer.keep(fname)
+            fnames.add(fname)
+        for fname in glob.glob(opj(self.dir, "*.json")):
+            if fname not in fnames:
+                os.remove(fname)
+
+        tmp = "%s.tmp" % self.fname
+        with open(tmp, 'w') as fp:
+            json.dump(self.state, fp)
+        os.rename(tmp, self.fname)
+        print("info   : indexed %d pages (%d words)" % (len(pages), words))
+
+# -----------------------------------------------------------------------------
+
+_macros_codes = {} # compiled macros modules by file name
+
+def load_macros(fname, builtins):
+    """Load the macros module and return its namespace.
+
+    Builtin macros are already available while the module gets loaded, e.g.
+    for use as decorators. The module gets executed freshly for every build,
+    but only compiled again if it changed.
+
+    """
+    st = os.stat(fname)
+    stamp = (st.st_mtime, st.st_size)
+    cached = _macros_codes.get(fname)
+    if cached is None or cached[0] != stamp:
+        with open(fname, 'rU') as fp:
+            code = compile(fp.read() + "\n", fname, "exec")
+        cached = _macros_codes[fname] = (stamp, code)
+
+    module = imp.new_module("macros")
+    module.__file__ = fname
+    module.__dict__.update(builtins)
+    sys.modules["macros"] = module
+    exec cached[1] in module.__dict__
+    return module.__dict__
+
+# -----------------------------------------------------------------------------
+
+def build(project, opts):
+    """Build a site project."""
+
+    writers = [] # stopped even if the build aborts, e.g. in watch mode
+    try:
+        return _build(project, opts, writers)
+    finally:
+        for writer in writers:
+            writer.stop()
+
+def _build(project, opts, writers):
+    """Build a site project, see `build()`."""
+
+    global _timings
+
+    import markdown
+
+    # -------------------------------------------------------------------------
+    # utilities
+    # -------------------------------------------------------------------------
+
+    def abort_iex(page, itype, inline, exc):
+        """Abort because of an exception in inlined Python code."""
+        print("abort  : Python %s in %s failed" % (itype, page))
+        print((" %s raising the exception " % itype).center(79, "-"))
+        print(inline)
+        print(" exception ".center(79, "-"))
+        print(exc)
+        sys.exit(1)
+
+    def run_hooks(pattern, *args):
+        """Call the functions in the macro module whose names match.
+
+        Incremental hooks (see `incremental_hook()`) get the changes of pages
+        since they ran last instead of `args`.
+
+        """
+        for fn in sorted(a for a in macros if re.match(pattern, a)):
+            start = time.time()
+            spec = getattr(macros[fn], "incremental", None)
+            if spec is None or args:
+                macros[fn](*args)
+            else:
+                changes = hooks.changes(fn, macros["pages"], spec[0])
+                if changes or spec[1] or not hooks.old:
+                    macros[fn](changes)
+                else:
+                    print("info   : skip %s (no changes)" % fn)
+            timing("hook", fn, time.time() - start)
+
+    def phase(name=None):
+        """End the current build phase and start the next one (if given)."""
+
+        prev, start = phases[-1]
+        seconds = time.time() - start
+        timing("phase", prev, seconds, memory=peak_memory())
+        run_hooks(r'hook_postphase_', prev, seconds)
+        if name is not None:
+            run_hooks(r'hook_prephase_', name)
+            phases.append((name, time.time()))
+
+    # -------------------------------------------------------------------------
+    # regex patterns and replacements
+    # -------------------------------------------------------------------------
+
+    regx_escp = re.compile(r'\\((?:(?:&lt;|<)!--|{)(?:{|%))') # escaped code
+    repl_escp = r'\1'
+    regx_rurl = re.compile(r'(?<=(?:(?:\n| )src|href)=["\'])([^"\'?#]+)')
+
+    def repl_rurl(m):
+        """Replace a reference to an asset by one to its fingerprinted copy."""
+
+        url = m.group(1)
+        if url.startswith(opts.base_url):
+            rel = url[len(opts.base_url):]
+        elif re.match(r'^(?:/|[a-zA-Z][a-zA-Z0-9+.-]*:)', url):
+            return url # outside of the site or on another one
+        else:
+            rel = posixpath.join(posixpath.dirname(macros["page"].url), url)
+        hashed = fingerprints.get(posixpath.normpath(rel))
+        if hashed is None:
+            return url
+        return url[:url.rfind("/") + 1] + posixpath.basename(hashed)
+
+    def asset_url(path):
+        """Get the URL of a file in the output folder (e.g. `css/site.css`).
+
+        If assets are fingerprinted, this is the URL of the fingerprinted copy.
+
+        """
+        path = path.lstrip("/")
+        return opts.base_url + fingerprints.get(path, path)
+
+    def run_eval(code, expr, where):
+        """Evaluate a Python expression block."""
+
+        start = time.time() if _timings is not None else None
+        try:
+            repl = eval(code, *block_namespace(code, macros))
+        except:
+            abort_iex(macros["page"], "expression", expr,
+                      traceback.format_exc())
+        else:
+            if not isinstance(repl, basestring): # e.g. numbers
+                repl = unicode(repl)
+            elif not isinstance(repl, unicode):
+                repl = repl.decode("utf-8")
+            if start is not None: # profiling
+                timing("eval", where[0], time.time() - start, line=where[1],
+                       page=macros["page"].url)
+            return repl
+
+    def run_exec(code, stmt, where):
+        """Execute a block of Python statements and return its output."""
+
+        start = time.time() if _timings is not None else None
+        try:
+            marker = cache_marker(stmt)
+        except SyntaxError: # invalid key expression
+            abort_iex(macros["page"], "statements", stmt,
+                      traceback.format_exc())
+        if marker is not None:
+            ckey = (stmt, run_eval(*marker + (where,)),
+                    _pages_state(macros["pages"]))
+            if ckey in _fragments:
+                count("fragment cache hits")
+                return _fragments[ckey]
+            count("fragment cache misses")
+
+        ns_globals, ns_locals = block_namespace(code, macros)
+        mark = stdout.begin()
+        try:
+            exec code in ns_globals, ns_locals
+        except:
+            stdout.end(mark)
+            abort_iex(macros["page"], "statements", stmt,
+                      traceback.format_exc())
+        else:
+            repl = stdout.end(mark)[:-1] # remove last line break
+            if not isinstance(repl, unicode):
+                repl = repl.decode(opts.input_enc)
+            if marker is not None:
+                _fragments[ckey] = repl
+            if start is not None: # profiling
+                timing("exec", where[0], time.time() - start, line=where[1],
+                       page=macros["page"].url)
+            return repl
+
+    def deps_key(names, html=False):
+        """Key over the macros data used by code with the given names.
+
+        If the code uses `pages` and reads page content, this includes the
+        content of all pages and, if `html` is true, their HTML.
+
+        """
+        deps = None if names is None else macro_deps(names, macros)
+        if deps is None:
+            return None
+        parts = []
+        for name in sorted(deps):
+            if name == _CONTENT and "pages" not in deps:
+                continue
+            if name not in reprs:
+                if name == _CONTENT:
+                    data = [p._digest() for p in macros["pages"]]
+                    if html:
+                        data.extend(sha1(p._html or "")
+                                    for p in macros["pages"])
+                else:
+                    data = [repr(macros[name])]
+                reprs[name] = sha1(*data)
+            parts.extend((name, reprs[name]))
+        return sha1(*parts)
+
+    def page_template(page):
+        """Parse a page's source as a template."""
+
+        name = page.fname[len(dir_in):].lstrip(os.path.sep)
+        first = 1 if page._modified else page._skip + 1
+        return Template(page.source, name, first)
+
+    def convert(page):
+        """Convert a page's source to HTML."""
+
+        print("info   : convert %s" % page)
+        start = time.time()
+
+        # replace expressions and statements in page source
+        macros["page"] = page
+        template = page_template(page)
+        page.unload()
+        out = template.render(run_eval, run_exec)
+
+        # convert to HTML
+        html = md_convert(out)
+        timing("convert", page.url, time.time() - start)
+        return html
+
+    def output_fname(page):
+        """Name of the HTML file to write for a page."""
+
+        fname = page.fname.replace(dir_in, dir_out)
+        return re.sub(MKD_PATT, ".html", fname)
+
+    def render(page):
+        """Render a complete HTML page and write it to the output folder."""
+
+        print("info   : render %s" % page.url)
+        start = time.time()
+
+        # replace expressions and statements in page.html
+        macros["page"] = page
+        macros["__content__"] = page.html
+        out = skeleton.render(run_eval, run_exec)
+
+        # un-escape escaped python code blocks
+        out = regx_escp.sub(repl_escp, out)
+
+        # refer to fingerprinted copies of assets
+        if fingerprints:
+            out = regx_rurl.sub(repl_rurl, out)
+
+        # write HTML page
+        writer.write(output_fname(page), out.encode(opts.output_enc))
+
+        page.unload() # other pages may still use its HTML
+        timing("render", page.url, time.time() - start)
+
+    # -------------------------------------------------------------------------
+    # preparations
+    # -------------------------------------------------------------------------
+
+    phases = [("setup", time.time())] # macros miss the start of this one
+    _timings = [] if opts.profile else None
+
+    stdout = StdoutCapture.install()
+    _counters.clear()
+    _fragments.clear()
+    for cache in (Template._codes, _shareable, _cache_markers):
+        cache.new_build()
+
+    dir_in = opj(project, "input")
+    dir_out = opj(project, "output")
+    page_html = opj(project, "page.html")
+
+    # check required files and folders
+    for pelem in (page_html, dir_in, dir_out):
+        if not opx(pelem):
+            print("abort  : %s does not exist, looks like project has not been "
+                  "initialized" % pelem)
+            sys.exit(1)
+
+    # incremental build state
+    manifest = Manifest(project) if opts.incremental else None
+
+    # files in the output folder are only replaced if they change, stale ones
+    # get removed at the end
+    writer = OutputWriter(dir_out, opts.filename_enc)
+    writers.append(writer)
+
+    fingerprints = {} # output file name -> fingerprinted copy (relative)
+
+    # "builtin" items for use in macros and templates
+    builtins = {
+        "hx": hx,
+        "htmlspecialchars": hx, # legacy name of `htmlx` function
+        "Page": Page,
+        "cached_fragment": cached_fragment,
+        "incremental_hook": incremental_hook,
+        "asset_url": asset_url,
+    }
+
+    # macro module
+    fname = opj(opts.project, "macros.py")
+    macros = load_macros(fname, builtins) if opx(fname) else {}
+    macros_src = open(fname, 'rb').read() if opx(fname) else ""
+
+    hooks = HookState(project, sha1(str(__version__), macros_src),
+                      opts.incremental)
+
+    macros["__encoding__"] = opts.output_enc
+    macros["options"] = opts
+    macros["project"] = project
+    macros["input"] = dir_in
+    macros["output"] = dir_out
+
+    macros.update(builtins)
+
+    # -------------------------------------------------------------------------
+    # process input files
+    # -------------------------------------------------------------------------
+
+    phase("walk")
+
+    Page._template = macros.get("page", {})
+    Page._opts = opts
+    Page._pstrip = dir_in
+    index = PageIndex(project, dir_in.decode(opts.filename_enc))
+    index.load()
+    pages = PageList()
+    converters = Converters(macros.get('converter', {}), dir_in)
+    conversions = []
+    assets = [] # output files of copied assets
+
+    for cwd, dirs, files in os.walk(dir_in.decode(opts.filename_enc)):
+        cwd_site = cwd[len(dir_in):].lstrip(os.path.sep)
+        for sdir in dirs[:]:
+            if re.search(opts.ignore, opj(cwd_site, sdir)):
+                dirs.remove(sdir)
+            else:
+                d_dst = opj(dir_out, cwd_site, sdir)
+                writer.keep(d_dst)
+                if manifest is not None:
+                    manifest.dir_done(d_dst, dir_out)
+                if not opx(d_dst):
+                    os.mkdir(d_dst)
+        for f in files:
+            if re.search(opts.ignore, opj(cwd_site, f)):
+                pass
+            elif re.search(MKD_PATT, f):
+                start = time.time()
+                page = Page(opj(cwd, f))
+                timing("parse", page.url, time.time() - start)
+                pages.append(page)
+            else:
+                # either use a custom converter (later) or do a plain copy
+                src = opj(cwd, f)
+                dst = opj(dir_out, cwd_site, f)
+                if not (opts.fingerprint or in_shard(
+                        opj(cwd_site, f).replace(os.sep, "/"), opts.shard)):
+                    continue # fingerprinting needs all assets in every shard
+                job = converters.job(src, dst)
+                if job is not None:
+                    conversions.append(job)
+                    writer.keep(job[2])
+                    continue
+                assets.append(dst)
+                writer.keep(dst)
+                if manifest is not None and \
+                   manifest.asset_done(src, dst, dir_out):
+                    continue
+                copy_asset(src, dst)
+
+    index.update(pages)
+    pages.sort(key=lambda p: int(p.get("sval", "0")))
+
+    macros["pages"] = pages
+
+    # -------------------------------------------------------------------------
+    # run pre-convert hooks in macro module (named 'once' before)
+    # -------------------------------------------------------------------------
+
+    phase("preconvert")
+    run_hooks(r'hook_preconvert_|once_')
+
+    # -------------------------------------------------------------------------
+    # convert pages (markdown to HTML)
+    # -------------------------------------------------------------------------
+
+    phase("convert")
+
+    with codecs.open(opj(project, "page.html"), 'r', opts.input_enc) as fp:
+        skeleton = fp.read()
+
+    extensions = []
+    for ext in opts.md_ext + MD_EXTENSIONS:
+        if ext not in extensions:
+            extensions.append(ext)
+    backend = macros.get("converter_backend", "markdown")
+    md_convert = md_converter(backend, extensions)
+
+    if not opts.no_cache:
+        # custom backends may be defined by (and change with) macros.py
+        md_cache = MarkdownCache(
+            opts.cache_dir or opj(project, ".poole", "markdown"),
+            opts.cache_limit * 2 ** 20, repr(extensions),
+            getattr(markdown, "version", ""),
+            backend if backend == "markdown" else macros_src)
+        md_convert = md_cache.wrap(md_convert)
+
+    # run custom converters while pages get converted
+    todo = []
+    for job in conversions:
+        if manifest is not None and manifest.conversion_done(
+                job[2], conversion_key(job, macros_src), dir_out):
+            continue
+        todo.append(job)
+    wait_conversions = pstart(convert_asset, todo, opts.jobs)
+
+    if opts.fingerprint:
+        # pages may refer to fingerprints (`asset_url`) of converted files
+        wait_conversions()
+        wait_conversions = lambda: None
+        fnames = [f for f in assets + [job[2] for job in conversions]
+                  if re.search(FINGERPRINT_PATT, f) and opx(f)]
+        for fname, hashed in zip(fnames, pmap(fingerprint, fnames, opts.jobs)):
+            rel = os.path.relpath(fname, dir_out).replace(os.path.sep, "/")
+            fingerprints[rel] = posixpath.join(posixpath.dirname(rel),
+                                               os.path.basename(hashed))
+            writer.keep(hashed)
+            if manifest is not None:
+                manifest.output_done(hashed, dir_out)
+        fname = opj(project, ".poole", "assets.json")
+        if not opx(os.path.dirname(fname)):
+            os.makedirs(os.path.dirname(fname))
+        with open(fname, 'w') as fp:
+            json.dump(fingerprints, fp, indent=1, sort_keys=True)
+        print("info   : fingerprinted %d files" % len(fingerprints))
+
+    if manifest is not None:
+        # anything which may affect the output of all pages
+        build_opts = repr((extensions, backend, opts.base_url,
+                           opts.input_enc, opts.output_enc))
+        manifest.prepare(str(__version__), macros_src, build_opts,
+                         repr(sorted(fingerprints.items())))
+
+    skeleton_src, skeleton = skeleton, Template(skeleton, "page.html")
+
+    ckeys = {}
+    reprs = {} # hashed macros data used by inline code
+    todo = []
+
+    for page in pages:
+        if not in_shard(page.url, opts.shard):
+            continue
+        if manifest is not None:
+            # parsed again by convert(), templates hold the whole source
+            names = page_template(page).names()
+            ckey = manifest.page_key(page, deps_key(names))
+            ckeys[page.url] = ckey
+            page.unload()
+            if manifest.load_html(page, ckey):
+                continue
+        todo.append(page)
+
+    for page, html in zip(todo, pmap(convert, todo, opts.jobs)):
+        page.html = html
+        if manifest is not None:
+            manifest.store_html(page, ckeys[page.url])
+
+    wait_conversions()
+
+    # -------------------------------------------------------------------------
+    # run post-convert hooks in macro module
+    # -------------------------------------------------------------------------
+
+    phase("postconvert")
+    run_hooks(r'hook_postconvert_')
+
+    # -------------------------------------------------------------------------
+    # write sitemap and feed (pages still have their HTML)
+    # -------------------------------------------------------------------------
+
+    feeds = FeedState(project, dir_out)
+
+    if opts.sitemap:
+        phase("sitemap")
+        entries = sorted((p.url, w3c_date(p.get("date"))) for p in pages
+                         if p.get("sitemap") != "no")
+        h = hashlib.sha1(opts.site_url.encode("utf-8"))
+        for entry in entries:
+            h.update(repr(entry))
+        fnames = feeds.fresh("sitemap", h.hexdigest())
+        if fnames is None:
+            fnames = write_sitemap(entries, dir_out, opts.site_url)
+            feeds.done("sitemap", h.hexdigest(), fnames)
+            print("info   : wrote sitemap (%d pages)" % len(entries))
+        del entries
+        for fname in fnames:
+            writer.keep(fname)
+
+    if opts.feed:
+        phase("feed")
+        settings = macros.get("feed", {})
+        posts = [p for p in pages.sorted_by("date", reverse=True)
+                 if "post" in p and w3c_date(p["date"])]
+        posts = posts[:int(settings.get("size", FEED_SIZE))]
+        key = sha1(opts.feed, opts.site_url, repr(sorted(settings.items())),
+                   *[x for p in posts for x in (p.url, p.get("post") or
+                                                p["title"], p["date"], p.html)])
+        fname = opj(dir_out, "%s.xml" % opts.feed)
+        if feeds.fresh("feed", key) is None:
+            write_feed(opts.feed, posts, fname, opts.site_url, settings)
+            feeds.done("feed", key, [fname])
+            print("info   : wrote %s feed (%d posts)" % (opts.feed, len(posts)))
+        writer.keep(fname)
+
+    feeds.save()
+
+    # -------------------------------------------------------------------------
+    # index pages for searching, while they get rendered
+    # -------------------------------------------------------------------------
+
+    if opts.search_index:
+        search = SearchIndex(project, opj(dir_out, "search"))
+        indexed = [p for p in pages if p.get("search") != "no" and not
+                   re.search(opts.ignore, os.path.relpath(p.fname, dir_in))]
+        reindex = search.todo(indexed)
+        wait_search = pstart(page_words, [p.html for p in reindex], opts.jobs)
+
+    # -------------------------------------------------------------------------
+    # render complete HTML pages
+    # -------------------------------------------------------------------------
+
+    phase("render")
+    todo = []
+
+    if manifest is not None:
+        reprs.clear() # hooks may have changed macros data
+        layout = deps_key(skeleton.names(), html=True)
+        layout = layout and sha1(skeleton_src, layout)
+
+    for page in pages:
+        if not in_shard(page.url, opts.shard):
+            continue
+        writer.keep(output_fname(page))
+        # virtual pages added by post-convert hooks have no conversion key
+        if manifest is not None and manifest.page_done(
+                page, ckeys.get(page.url), layout, output_fname(page),
+                dir_out):
+            continue
+        todo.append(page)
+
+    pmap(render, todo, opts.jobs)
+
+    if opts.search_index:
+        phase("search")
+        search.update(reindex, wait_search())
+        search.write(indexed, writer)
+
+    for page in pages:
+        page.release()
+
+    phase("finish")
+
+    writer.wait()
+
+    if manifest is None or not manifest.old:
+        writer.prune(opts.precompress)
+    else:
+        manifest.prune(dir_out)
+
+    if opts.precompress:
+        precompress(dir_out, opts.jobs)
+
+    if opts.shard is not None:
+        shard_manifest(dir_out, opts.shard)
+
+    writer.report(opj(project, ".poole", "changes.json"))
+
+    if not opts.no_cache:
+        md_cache.evict()
+
+    if manifest is not None:
+        manifest.save()
+
+    hooks.save()
+
+    phase()
+
+    if opts.profile:
+        seconds = time.time() - phases[0][1]
+        profile_report(opts.profile, _timings, seconds)
+
+    for name, n in sorted(_counters.items()):
+        print("info   : %s: %d" % (name, n))
+
+    print("success: built project")
+
+    return macros
+
+# =============================================================================
+# watch site
+# =============================================================================
+
+WATCH_INTERVAL = 0.5 # seconds between checks for changes
+
+def _snapshot(project, opts):
+    """Get modification times and sizes of a project's source files."""
+
+    dir_in = opj(project, "input")
+    snapshot = {}
+    for fname in (opj(project, "page.html"), opj(project, "macros.py")):
+        if opx(fname):
+            st = os.stat(fname)
+            snapshot[fname] = (st.st_mtime, st.st_size)
+    for cwd, dirs, files in os.walk(dir_in.decode(opts.filename_enc)):
+        cwd_site = cwd[len(dir_in):].lstrip(os.path.sep)
+        for sdir in dirs[:]:
+            if re.search(opts.ignore, opj(cwd_site, sdir)):
+                dirs.remove(sdir)
+        for f in files:
+            if not re.search(opts.ignore, opj(cwd_site, f)):
+                try:
+                    st = os.stat(opj(cwd, f))
+                except OSError: # deleted meanwhile
+                    continue
+                snapshot[opj(cwd, f)] = (st.st_mtime, st.st_size)
+    return snapshot
+
+def watch(project, opts):
+    """Rebuild a site project whenever its source files change.
+
+    Builds are incremental, i.e. only pages affected by a change get rebuilt.
+    If only files other than pages changed, these just get copied (or
+    converted) to the output folder.
+
+    """
+    dir_in = opj(project, "input")
+    dir_out = opj(project, "output")
+    opts.incremental = True
+
+    def rebuild():
+        try:
+            return build(project, opts)
+        except SystemExit: # abort message has been printed already
+            print("error  : build failed, waiting for changes")
+            return None
+
+    macros = rebuild()
+    snapshot = _snapshot(project, opts)
+    print("info   : watching %s for changes (Ctrl-C to stop)" % project)
+
+    try:
+        while True:
+            time.sleep(WATCH_INTERVAL)
+            current = _snapshot(project, opts)
+            if current == snapshot:
+                continue
+            changed = [f for f in set(snapshot) | set(current)
+                       if snapshot.get(f) != current.get(f)]
+            snapshot = current
+            assets = [f for f in changed if f.startswith(dir_in) and
+                      not re.search(MKD_PATT, f)]
+            if macros is None or opts.fingerprint or \
+               len(assets) < len(changed):
+                macros = rebuild()
+                continue
+            converters = Converters(macros.get('converter', {}), dir_in)
+            if any(converters.is_dependency(f) for f in assets):
+                macros = rebuild()
+                continue
+            for src in sorted(assets):
+                dst = opj(dir_out, src[len(dir_in):].lstrip(os.path.sep))
+                job = converters.job(src, dst)
+                if src not in current:
+                    if opx(dst):
+                        print("info   : remove %s" % dst)
+                        os.remove(dst)
+                elif job is not None:
+                    convert_asset(job)
+                else:
+                    print("info   : copy %s" % src)
+                    if not opx(os.path.dirname(dst)):
+                        os.makedirs(os.path.dirname(dst))
+                    copy_asset(src, dst)
+    except KeyboardInterrupt:
+        print("info   : stopped watching")
+
+# =============================================================================
+# build daemon
+# =============================================================================
+
+def _daemon_socket(project):
+    """Name of the socket a project's build daemon listens on."""
+
+    return opj(project, ".poole", "daemon.sock")
+
+def _daemon_connect(project):
+    """Connect to a project's build daemon, return `None` if there is none."""
+
+    import socket
+
+    fname = _daemon_socket(project)
+    if not hasattr(socket, "AF_UNIX") or not opx(fname):
+        return None
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(fname)
+    except socket.error: # stale socket file
+        conn.close()
+        return None
+    return conn
+
+def _daemon_build(project, cwd, args):
+    """Build a project as requested by a client.
+
+    Returns the exit status and everything printed meanwhile, including the
+    output of worker processes.
+
+    """
+    import tempfile
+
+    status, cwd_daemon = 0, os.getcwd()
+    out = tempfile.TemporaryFile()
+    sys.stdout.flush()
+    stdout_fd = os.dup(1)
+    os.dup2(out.fileno(), 1)
+    try:
+        os.chdir(cwd) # options may contain paths relative to the client's cwd
+        opts = options(args)
+        opts.project = project
+        build(project, opts)
+    except SystemExit as e:
+        status = e.code if isinstance(e.code, int) else 1
+    except Exception:
+        traceback.print_exc(file=sys.stdout)
+        status = 1
+    finally:
+        sys.stdout.flush()
+        os.dup2(stdout_fd, 1)
+        os.close(stdout_fd)
+        os.chdir(cwd_daemon)
+    out.seek(0)
+    return status, out.read()
+
+def daemon(project):
+    """Keep Poole loaded for a project and build it whenever asked to.
+
+    Between builds the daemon keeps everything which does not depend on the
+    project's current state: imported modules, compiled inline code, markdown
+    converters as well as compiled `macros.py` code and page attributes of
+    files which did not change. Builds are requested by `build_client()` and
+    run one after another.
+
+    """
+    import socket
+    import SocketServer
+
+    if not hasattr(socket, "AF_UNIX"):
+        print("abort  : daemon mode is not supported on this platform")
+        sys.exit(1)
+
+    class DaemonHandler(SocketServer.StreamRequestHandler):
+        """Handle a build request of `build_client()`."""
+
+        def handle(self):
+
+            line = self.rfile.readline()
+            if not line: # just checking if the daemon is running
+                return
+            request = json.loads(line)
+            status, output = _daemon_build(self.server.project,
+                                           request["cwd"], request["args"])
+            self.wfile.write("%s\n" % json.dumps({"status": status}))
+            self.wfile.write(output)
+
+    project = os.path.abspath(project)
+    fname = _daemon_socket(project)
+    conn = _daemon_connect(project)
+    if conn is not None:
+        conn.close()
+        print("abort  : a daemon is already running for %s" % project)
+        sys.exit(1)
+    if opx(fname):
+        os.remove(fname)
+    elif not opx(os.path.dirname(fname)):
+        os.makedirs(os.path.dirname(fname))
+
+    server = SocketServer.UnixStreamServer(fname, DaemonHandler)
+    server.project = project
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    print("info   : daemon for %s listening on %s (Ctrl-C to stop)" % (
+          project, fname))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("info   : stopped daemon")
+    finally:
+        server.server_close()
+        os.remove(fname)
+
+def build_client(project, args):
+    """Let a running daemon build a project.
+
+    `args` are the command line arguments for the build. Returns false if no
+    daemon is running for the project, otherwise prints the daemon's output
+    and exits if the build failed.
+
+    """
+    conn = _daemon_connect(project)
+    if conn is None:
+        return False
+    try:
+        conn.sendall("%s\n" % json.dumps({"cwd": os.getcwd(), "args": args}))
+        fp = conn.makefile('rb')
+        response = json.loads(fp.readline())
+        sys.stdout.flush()
+        shutil.copyfileobj(fp, sys.stdout)
+    finally:
+        conn.close()
+    if response["status"]:
+        sys.exit(response["status"])
+    return True
+
+# =============================================================================
+# merge sharded builds
+# =============================================================================
+
+def merge(project, dirs):
+    """Merge the output folders of sharded builds into a project's output.
+
+    `dirs` must contain the output folders of all shards of one build. Files
+    built by more than one shard (e.g. by hooks) must be identical, otherwise
+    the merge aborts without touching the project's output folder. Hidden
+    files in the output folder are kept, as in builds.
+
+    """
+    dir_out = opj(project, "output")
+    for dname in dirs:
+        if os.path.realpath(dname) == os.path.realpath(dir_out):
+            print("abort  : can't merge %s into itself, move it elsewhere "
+                  "first" % dname)
+            sys.exit(1)
+    shards = {} # shard number -> number of shards
+    files = {} # relative file name -> (digest, output folder)
+    conflicts = []
+
+    for dname in dirs:
+        fname = opj(dname, SHARD_MANIFEST)
+        if not opx(fname):
+            print("abort  : %s is not the output of a sharded build" % dname)
+            sys.exit(1)
+        with open(fname) as fp:
+            shard = json.load(fp)
+        if shard["shard"] in shards:
+            print("abort  : shard %d/%d given twice" % (shard["shard"],
+                                                        shard["shards"]))
+            sys.exit(1)
+        shards[shard["shard"]] = shard["shards"]
+        for rel, digest in shard["files"].items():
+            other = files.setdefault(rel, (digest, dname))
+            if other[0] != digest:
+                conflicts.append("%s (%s, %s)" % (rel, other[1], dname))
+
+    counts = set(shards.values())
+    if len(counts) != 1:
+        print("abort  : shards belong to different builds (%s)" %
+              ", ".join("%d/%d" % x for x in sorted(shards.items())))
+        sys.exit(1)
+    n = counts.pop()
+    missing = sorted(set(range(1, n + 1)) - set(shards))
+    if missing:
+        print("abort  : missing shards %s" %
+              ", ".join("%d/%d" % (i, n) for i in missing))
+        sys.exit(1)
+    for conflict in sorted(conflicts):
+        print("error  : shards built different versions of %s" % conflict)
+    if conflicts:
+        print("abort  : %d conflicting files" % len(conflicts))
+        sys.exit(1)
+
+    # merge into a new folder first, the old output stays if this fails
+    tmp = tempfile.mkdtemp(prefix=".merge-", dir=project)
+    try:
+        for rel, (digest, dname) in sorted(files.items()):
+            dst = opj(tmp, *rel.split("/"))
+            if not opx(os.path.dirname(dst)):
+                os.makedirs(os.path.dirname(dst))
+            shutil.copy2(opj(dname, *rel.split("/")), dst) # keep gzip newer
+    except EnvironmentError as e:
+        shutil.rmtree(tmp)
+        print("abort  : failed to merge shards: %s" % e)
+        sys.exit(1)
+
+    if opx(dir_out):
+        for name in os.listdir(dir_out): # hidden files, e.g. `.git`
+            if name.startswith("."):
+                os.rename(opj(dir_out, name), opj(tmp, name))
+        old = "%s-old" % tmp
+        os.rename(dir_out, old)
+        os.rename(tmp, dir_out)
+        shutil.rmtree(old)
+    else:
+        os.rename(tmp, dir_out)
+
+    print("success: merged %d shards (%d files)" % (n, len(files)))
+
+# =============================================================================
+# serve site
+# =============================================================================
+
+def serve(project, port, cache_size=64):
+    """Temporary serve a site project."""
+
+    from _serve import FileCache, RequestHandler, ThreadingHTTPServer
+
+    root = opj(project, "output")
+    if not os.listdir(project):
+        print("abort  : output dir is empty (build project first!)")
+        sys.exit(1)
+
+    class Handler(RequestHandler):
+        pass
+
+    Handler.root = root
+    Handler.cache = FileCache(cache_size * 1024 * 1024, GZIP_MIN_SIZE)
+
+    print 'serving on port: ',port
+    server = ThreadingHTTPServer(('', port), Handler)
+    server.serve_forever()
+
+# =============================================================================
+# options
+# =============================================================================
+
+def options(args=None):
+    """Parse and validate command line arguments (default: `sys.argv`)."""
+
+    usage = ("Usage: %prog --init  [OPTIONS] [path/to/project]\n"
+             "       %prog --build [OPTIONS] [path/to/project]\n"
+             "       %prog --serve [OPTIONS] [path/to/project]\n"
+             "       %prog --watch [OPTIONS] [path/to/project]\n"
+             "       %prog --daemon [OPTIONS] [path/to/project]\n"
+             "       %prog --merge DIR [--merge DIR ...] [path/to/project]\n"
+             "\n"
+             "       Project path is optional, '.' is used as default.")
+
+    op = optparse.OptionParser(usage=usage)
+
+    op.add_option("-i" , "--init", action="store_true", default=False,
+                  help="init project")
+    op.add_option("-b" , "--build", action="store_true", default=False,
+                  help="build project")
+    op.add_option("-s" , "--serve", action="store_true", default=False,
+                  help="serve project")
+    op.add_option("-w" , "--watch", action="store_true", default=False,
+                  help="build project whenever it changes (may be combined "
+                       "with --serve)")
+    op.add_option("-d" , "--daemon", action="store_true", default=False,
+                  help="keep project loaded and build it whenever requested "
+                       "by --build --connect")
+    op.add_option("-m" , "--merge", default=[], metavar="DIR",
+                  action="append", help="merge the output folder of a "
+                  "--shard build into the project (give all shards)")
+
+    og = optparse.OptionGroup(op, "Init options")
+    og.add_option("", "--theme", default="minimal", metavar="THEME",
+                  help="theme for a new project (default: minimal)")
+    op.add_option_group(og)
+
+    og = optparse.OptionGroup(op, "Build options")
+    og.add_option("", "--base-url", default="/", metavar="URL",
+                  help="base url for relative links (default: /)")
+    og.add_option("" , "--ignore", default=r"^\.|~$", metavar="REGEX",
+                  help="input files to ignore (default: '^\.|~$')")
+    og.add_option("" , "--md-ext", default=[], metavar="EXT",
+                  action="append", help="enable a markdown extension")
+    og.add_option("", "--input-enc", default="utf-8", metavar="ENC",
+                  help="encoding of input pages (default: utf-8)")
+    og.add_option("", "--output-enc", default="utf-8", metavar="ENC",
+                  help="encoding of output pages (default: utf-8)")
+    og.add_option("", "--filename-enc", default="utf-8", metavar="ENC",
+                  help="encoding of file names (default: utf-8)")
+    og.add_option("", "--incremental", action="store_true", default=False,
+                  help="only rebuild pages and files whose inputs changed")
+    og.add_option("", "--jobs", default=1, metavar="N", type="int",
+                  help="number of processes to convert and render pages with "
+                       "(default: 1)")
+    og.add_option("", "--precompress", action="store_true", default=False,
+                  help="write gzipped copies of text files in the output "
+                       "folder")
+    og.add_option("", "--fingerprint", action="store_true", default=False,
+                  help="write copies of assets with content hashes in their "
+                       "names and refer to these in pages")
+    og.add_option("", "--sitemap", action="store_true", default=False,
+                  help="write a sitemap of all pages")
+    og.add_option("", "--feed", default=None, metavar="FORMAT",
+                  choices=["atom", "rss"],
+                  help="write a feed of blog posts, 'atom' or 'rss'")
+    og.add_option("", "--search-index", action="store_true", default=False,
+                  help="write an index of the words in pages for searching "
+                       "to output/search")
+    og.add_option("", "--site-url", default=None, metavar="URL",
+                  help="absolute URL of the site for sitemaps and feeds "
+                       "(default: --base-url if it is absolute)")
+    og.add_option("", "--cache-dir", default=None, metavar="DIR",
+                  help="folder for caching converted markdown, may be shared "
+                       "by projects (default: .poole/markdown in the project)")
+    og.add_option("", "--cache-limit", default=100, metavar="MB", type="int",
+                  help="maximum size of the markdown cache (default: 100)")
+    og.add_option("", "--no-cache", action="store_true", default=False,
+                  help="neither use nor update the markdown cache")
+    og.add_option("", "--connect", action="store_true", default=False,
+                  help="let a running --daemon build the project (if there "
+                       "is none, build as usual)")
+    og.add_option("", "--profile", default=None, metavar="FILE",
+                  help="write a JSON report on where build time is spent")
+    og.add_option("", "--shard", default=None, metavar="I/N",
+                  help="only convert and render the I-th of N parts of the "
+                       "site (combine shards with --merge)")
+    op.add_option_group(og)
+
+    og = optparse.OptionGroup(op, "Serve options")
+    og.add_option("" , "--port", default=8080,
+                  metavar="PORT", type="int",
+                  help="port for serving (default: 8080)")
+    og.add_option("" , "--cache-size", default=64,
+                  metavar="MB", type="int",
+                  help="memory for caching served files (default: 64)")
+    op.add_option_group(og)
+
+    opts, args = op.parse_args(args)
+
+    if opts.init + opts.build + opts.serve + opts.watch + opts.daemon + \
+       bool(opts.merge) < 1:
+        op.print_help()
         op.exit()
 
+    if opts.shard is not None:
+        try:
+            opts.shard = tuple(int(x) for x in opts.shard.split("/"))
+            i, n = opts.shard
+        except ValueError:
+            op.error("--shard must look like 1/4")
+        if not 1 <= i <= n:
+            op.error("--shard must be within 1/%d and %d/%d" % (n, n, n))
+        if opts.feed or opts.search_index:
+            op.error("--feed and --search-index need the HTML of all pages, "
+                     "they can't be combined with --shard")
+
+    if opts.sitemap or opts.feed:
+        if opts.site_url is None and re.match(r'https?://', opts.base_url):
+            opts.site_url = opts.base_url
+        if opts.site_url is None:
+            op.error("--sitemap and --feed need an absolute --site-url")
+        opts.site_url = opts.site_url.rstrip("/") + "/"
+
     opts.project = args and args[0] or "."
 
     return opts
@@ -738,10 +3560,23 @@ def main():
 
     if opts.init:
         init(opts.project, opts.theme)
-    if opts.build:
-        build(opts.project, opts)
-    if opts.serve:
-        serve(opts.project, opts.port)
+    if opts.watch:
+        project = opts.project
+        if opts.serve:
+            server = threading.Thread(target=serve, args=(
+                project, opts.port, opts.cache_size))
+            server.daemon = True
+            server.start()
+        watch(project, opts)
+    elif opts.daemon:
+        daemon(opts.project)
+    elif opts.merge:
+        merge(opts.project, opts.merge)
+    elif opts.build:
+        if not (opts.connect and build_client(opts.project, sys.argv[1:])):
+            build(opts.project, opts)
+    if opts.serve and not opts.watch:
+        serve(opts.project, opts.port, opts.cache_size)
 
 if __name__ == '__main__':
 
@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+
+""" poole._serve
+
+HTTP server for serving a site's output folder. This is a module of its own
+so only `poole --serve` has to import the web server modules.
+"""
+
+from __future__ import with_statement
+
+import email.utils
+import os
+from os.path import join as opj
+from os.path import exists as opx
+import re
+import SocketServer
+import threading
+import zlib
+
+from SimpleHTTPServer import SimpleHTTPRequestHandler
+from BaseHTTPServer import HTTPServer
+
+class ThreadingHTTPServer(SocketServer.ThreadingMixIn, HTTPServer):
+    """HTTP server handling each request in a separate thread."""
+
+    daemon_threads = True
+
+GZIP_TYPES = re.compile(r'^(?:text/|image/svg\+xml|application/(?:javascript|'
+                        r'x-javascript|json|xml|rss\+xml|atom\+xml))')
+
+class FileCache(object):
+    """Thread-safe, size-bounded cache of output files.
+
+    Entries get invalidated when the modification time or size of a file
+    changes. If the cache is full, least recently used entries are evicted.
+    Next to the content of a file, the cache holds its gzipped content (read
+    from a precompressed `.gz` sibling if that is up to date) if the file is
+    at least `gzip_min_size` bytes large.
+
+    """
+    def __init__(self, capacity, gzip_min_size):
+
+        self.capacity = capacity
+        self.gzip_min_size = gzip_min_size
+        self._entries = {} # path -> [stat key, data, gzipped data, last use]
+        self._size = 0
+        self._tick = 0
+        self._lock = threading.Lock()
+
+    def get(self, path, st, ctype):
+        """Get the plain and gzipped content of a file.
+
+        Gzipped content is `None` if the file is not worth compressing. If the
+        file is too large to be cached, the result is `None`.
+
+        """
+        if st.st_size > self.capacity // 8:
+            return None
+        key = (st.st_mtime, st.st_size)
+        with self._lock:
+            self._tick += 1
+            entry = self._entries.get(path)
+            if entry and entry[0] == key:
+                entry[3] = self._tick
+                return entry[1], entry[2]
+
+        with open(path, 'rb') as fp:
+            data = fp.read()
+        gz = None
+        if GZIP_TYPES.match(ctype) and len(data) >= self.gzip_min_size:
+            fgz = "%s.gz" % path
+            if opx(fgz) and os.path.getmtime(fgz) >= st.st_mtime:
+                with open(fgz, 'rb') as fp:
+                    gz = fp.read()
+            else:
+                zobj = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+                gz = zobj.compress(data) + zobj.flush()
+
+        with self._lock:
+            old = self._entries.pop(path, None)
+            if old:
+                self._size -= len(old[1]) + len(old[2] or "")
+            self._entries[path] = [key, data, gz, self._tick]
+            self._size += len(data) + len(gz or "")
+            while self._size > self.capacity:
+                lru = min(self._entries, key=lambda p: self._entries[p][3])
+                old = self._entries.pop(lru)
+                self._size -= len(old[1]) + len(old[2] or "")
+
+        return data, gz
+
+class RequestHandler(SimpleHTTPRequestHandler):
+    """Request handler for serving a site's output folder.
+
+    Supports keep-alive connections, conditional requests (`ETag` and
+    `Last-Modified`), gzip encoding and single byte range requests. Files are
+    served from a `FileCache` if they are small enough.
+
+    """
+    protocol_version = "HTTP/1.1"
+
+    root = None # folder to serve
+    cache = None # FileCache instance
+
+    def translate_path(self, path):
+
+        path = SimpleHTTPRequestHandler.translate_path(self, path)
+        return opj(self.root, os.path.relpath(path, os.getcwd()))
+
+    def do_GET(self):
+        self._respond(True)
+
+    def do_HEAD(self):
+        self._respond(False)
+
+    def _respond(self, body):
+        """Send a response, including the body if `body` is true."""
+
+        path = self.translate_path(self.path)
+
+        if os.path.isdir(path):
+            if not self.path.split('?', 1)[0].endswith('/'):
+                self.send_response(301)
+                self.send_header("Location", self.path.replace('?', '/?', 1)
+                                 if '?' in self.path else self.path + '/')
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            if not opx(opj(path, "index.html")):
+                f = self.list_directory(path)
+                if f:
+                    if body:
+                        self.copyfile(f, self.wfile)
+                    f.close()
+                return
+            path = opj(path, "index.html")
+
+        try:
+            st = os.stat(path)
+        except OSError:
+            self.send_error(404, "File not found")
+            return
+
+        ctype = self.guess_type(path)
+        data, gz = self.cache.get(path, st, ctype) or (None, None)
+        use_gz = (gz is not None and not self.headers.get("Range") and
+                  "gzip" in self.headers.get("Accept-Encoding", ""))
+        etag = '"%x-%x%s"' % (int(st.st_mtime * 1000), st.st_size,
+                              use_gz and "-gz" or "")
+        headers = [("ETag", etag),
+                   ("Last-Modified", self.date_time_string(st.st_mtime))]
+        if gz is not None:
+            headers.append(("Vary", "Accept-Encoding"))
+
+        if self._not_modified(etag, st.st_mtime):
+            self.send_response(304)
+            for header in headers:
+                self.send_header(*header)
+            self.end_headers()
+            return
+
+        if use_gz:
+            data = gz
+            headers.append(("Content-Encoding", "gzip"))
+        length = st.st_size if data is None else len(data)
+        first, last = 0, length - 1
+        status = 200
+
+        if not use_gz:
+            headers.append(("Accept-Ranges", "bytes"))
+            rng = self._range(length, headers)
+            if rng == 416:
+                self.send_response(416)
+                self.send_header("Content-Range", "bytes */%d" % length)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            if rng:
+                first, last = rng
+                status = 206
+                headers.append(("Content-Range", "bytes %d-%d/%d" %
+                                (first, last, length)))
+
+        self.send_response(status)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(last - first + 1))
+        for header in headers:
+            self.send_header(*header)
+        self.end_headers()
+
+        if not body:
+            pass
+        elif data is not None:
+            self.wfile.write(data[first:last + 1])
+        else: # too large for the cache, stream from disk
+            with open(path, 'rb') as fp:
+                fp.seek(first)
+                left = last - first + 1
+                while left > 0:
+                    chunk = fp.read(min(left, 64 * 1024))
+                    if not chunk:
+                        break
+                    self.wfile.write(chunk)
+                    left -= len(chunk)
+
+    def _not_modified(self, etag, mtime):
+        """Check if the client's copy of a file is still valid."""
+
+        inm = self.headers.get("If-None-Match")
+        if inm is not None:
+            tags = [t.strip() for t in inm.split(",")]
+            return etag in tags or "*" in tags
+        ims = self.headers.get("If-Modified-Since")
+        if ims is not None:
+            ims = email.utils.parsedate_tz(ims)
+            return ims is not None and \
+                   int(mtime) <= email.utils.mktime_tz(ims)
+        return False
+
+    def _range(self, length, headers):
+        """Get the byte range requested by the client.
+
+        Returns `None` if the full content should be sent, a `(first, last)`
+        tuple for partial content or 416 if the range cannot be satisfied.
+        Multiple ranges are not supported (the full content is sent then).
+
+        """
+        rng = self.headers.get("Range")
+        if not rng:
+            return None
+        if_range = self.headers.get("If-Range")
+        if if_range and if_range not in [value for _, value in headers]:
+            return None
+        m = re.match(r'^bytes=(\d*)-(\d*)$', rng.strip())
+        if not m or not (m.group(1) or m.group(2)):
+            return None
+        if not m.group(1): # suffix range
+            suffix = int(m.group(2))
+            if suffix == 0:
+                return 416
+            return max(0, length - suffix), length - 1
+        first = int(m.group(1))
+        last = min(int(m.group(2) or length - 1), length - 1)
+        if first > last:
+            return 416
+        return first, last
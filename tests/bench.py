@@ -0,0 +1,317 @@
+#!/usr/bin/env python
+
+"""Benchmark Poole on synthetic projects.
+
+For each requested number of pages, a project gets initialized (optionally
+with one of the bundled themes) and filled with generated pages and assets.
+Then a full build and incremental rebuilds are timed and the peak memory of
+each step is measured. Results are compared against a stored baseline (see
+`--save`), which only makes sense on the machine the baseline was taken on.
+
+"""
+
+import hashlib
+import json
+import optparse
+import os
+import random
+import shutil
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(HERE, "..")
+SITES = os.path.join(HERE, "bench")
+BASELINE = os.path.join(HERE, "bench-baseline.json")
+
+POOLE = [sys.executable, "-m", "poole._poole"]
+
+WORDS = ("lorem ipsum dolor sit amet consectetur adipiscing elit sed do "
+         "eiusmod tempor incididunt ut labore et dolore magna aliqua enim ad "
+         "minim veniam quis nostrud exercitation ullamco laboris nisi aliquip "
+         "ex ea commodo consequat duis aute irure in reprehenderit").split()
+
+BLOCKS = [
+    '{{ hx(page["title"]) }}',
+    '{{ page.get("date", "no date") }}',
+    '{{ len(pages) }}',
+    '{%\nfor w in page["title"].split():\n    print(w.upper())\n%}',
+    '<!--%\nprint(", ".join(sorted(page.keys())))\n%-->',
+]
+
+STEPS = ("init", "build", "incremental", "noop", "touch")
+
+# =============================================================================
+# generate projects
+# =============================================================================
+
+def text(rng, size):
+    """Generate markdown text of about `size` bytes."""
+
+    paras, n = [], 0
+    while n < size:
+        words = [rng.choice(WORDS) for _ in range(rng.randint(20, 80))]
+        words[rng.randrange(len(words))] = "*%s*" % rng.choice(WORDS)
+        para = " ".join(words).capitalize() + "."
+        if rng.random() < 0.2:
+            para = "## %s\n\n%s" % (rng.choice(WORDS).capitalize(), para)
+        elif rng.random() < 0.2:
+            para = "\n".join("- %s" % w for w in words[:5])
+        paras.append(para)
+        n += len(para) + 2
+    return "\n\n".join(paras)
+
+def blob(seed, size):
+    """Generate `size` bytes of reproducible binary data."""
+
+    chunks, digest = [], hashlib.sha1(str(seed)).digest()
+    for _ in range(0, size, len(digest)):
+        digest = hashlib.sha1(digest).digest()
+        chunks.append(digest)
+    return "".join(chunks)[:size]
+
+def generate(dir_in, opts, pages):
+    """Add generated pages and assets to an input folder."""
+
+    rng = random.Random(opts.seed)
+
+    for i in range(pages):
+        subdirs = ["s%d" % ((i // 10 ** k) % 10) for k in range(opts.depth)]
+        dname = os.path.join(dir_in, "bench", *subdirs)
+        if not os.path.exists(dname):
+            os.makedirs(dname)
+        if rng.random() < opts.posts:
+            fname = "post%d.%04d-%02d-%02d.post_%d.md" % (
+                i, rng.randint(2000, 2020), rng.randint(1, 12),
+                rng.randint(1, 28), i)
+        else:
+            fname = "page%d.md" % i
+        body = text(rng, opts.body_size).split("\n\n")
+        for _ in range(opts.blocks):
+            pos = rng.randint(0, len(body))
+            body.insert(pos, rng.choice(BLOCKS))
+        with open(os.path.join(dname, fname), 'w') as fp:
+            fp.write("title: Page %d\n" % i)
+            fp.write("description: %s\n" % " ".join(rng.sample(WORDS, 8)))
+            fp.write("---\n")
+            fp.write("\n\n".join(body))
+
+    dname = os.path.join(dir_in, "assets")
+    if opts.assets and not os.path.exists(dname):
+        os.makedirs(dname)
+    for i in range(opts.assets):
+        if i % 2:
+            fname, data = "file%d.css" % i, text(rng, opts.asset_size)
+        else:
+            fname, data = "file%d.bin" % i, blob(i, opts.asset_size)
+        with open(os.path.join(dname, fname), 'wb') as fp:
+            fp.write(data[:opts.asset_size])
+
+# =============================================================================
+# run benchmarks
+# =============================================================================
+
+def run(args):
+    """Run Poole and return its run time in seconds and peak memory in KiB."""
+
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [ROOT] + [p for p in [env.get("PYTHONPATH")] if p])
+    start = time.time()
+    p = subprocess.Popen(POOLE + args, stdout=subprocess.PIPE, env=env)
+    output = p.stdout.read()
+    _, status, usage = os.wait4(p.pid, 0) # unlike wait(), tells memory usage
+    p.returncode = status
+    seconds = time.time() - start
+    if status:
+        sys.stdout.write(output)
+        print("failed: %s" % " ".join(args))
+        sys.exit(1)
+    return seconds, usage.ru_maxrss
+
+def snapshot(project):
+    """Save the build state and output of a project.
+
+    Returns a function restoring them, which removes the copy if called with
+    `keep=False`.
+
+    """
+    saved = project + "-snapshot"
+    if os.path.exists(saved):
+        shutil.rmtree(saved)
+    os.makedirs(saved)
+    names = [n for n in (".poole", "output")
+             if os.path.exists(os.path.join(project, n))]
+    for name in names:
+        shutil.copytree(os.path.join(project, name), os.path.join(saved, name))
+
+    def restore(keep=True):
+        for name in (".poole", "output"):
+            if os.path.exists(os.path.join(project, name)):
+                shutil.rmtree(os.path.join(project, name))
+        for name in names:
+            shutil.copytree(os.path.join(saved, name),
+                            os.path.join(project, name))
+        if not keep:
+            shutil.rmtree(saved)
+
+    return restore
+
+def bench(opts, pages):
+    """Benchmark a project with the given number of pages."""
+
+    project = os.path.join(SITES, "pages-%d" % pages)
+    if os.path.exists(project):
+        shutil.rmtree(project)
+
+    build = [project, "--build"] + opts.build_args.split()
+    steps = {}
+
+    def step(name, args, change=None):
+        """Time a step, `change()` modifies the project before each run.
+
+        Each run starts from the same build state and output, so repeated
+        runs do the same work as the first one (e.g. they do not reuse caches
+        written by previous runs).
+
+        """
+        repeat = opts.repeat if name != "init" else 1
+        restore = snapshot(project) if repeat > 1 else None
+        best = None
+        for i in range(repeat):
+            if i:
+                restore(keep=i < repeat - 1)
+            if change is not None:
+                change()
+            result = run(args)
+            if best is None or result[0] < best[0]:
+                best = result
+        steps[name] = {"seconds": best[0], "memory": best[1]}
+        print("%8d pages  %-12s %8.3fs %10s KiB" % (
+              pages, name, best[0], best[1]))
+
+    step("init", [project, "--init", "--theme", opts.theme])
+    generate(os.path.join(project, "input"), opts, pages)
+    step("build", build)
+    step("incremental", build + ["--incremental"])
+    step("noop", build + ["--incremental"])
+
+    # touch one page deep within the site
+    for cwd, dirs, files in os.walk(os.path.join(project, "input", "bench")):
+        if files:
+            fname = os.path.join(cwd, sorted(files)[-1])
+
+    def touch():
+        with open(fname, 'a') as fp:
+            fp.write("\n\nChanged.\n")
+
+    step("touch", build + ["--incremental"], touch)
+
+    shutil.rmtree(project)
+    return steps
+
+def compare(results, baseline, tolerance):
+    """Compare results with a baseline, return the number of regressions."""
+
+    regressions = 0
+    for pages, steps in sorted(results.items(), key=lambda x: int(x[0])):
+        for name in STEPS:
+            old = baseline.get(pages, {}).get(name)
+            if not old or not old["seconds"]:
+                continue
+            new = steps[name]
+            ratio = new["seconds"] / old["seconds"]
+            flag = ""
+            if ratio > 1 + tolerance:
+                flag = "  <-- slower"
+                regressions += 1
+            print("%8s pages  %-12s %8.3fs -> %8.3fs (%+.0f%%)%s" % (
+                  pages, name, old["seconds"], new["seconds"],
+                  (ratio - 1) * 100, flag))
+    return regressions
+
+# =============================================================================
+# main
+# =============================================================================
+
+def options():
+    """Parse command line arguments."""
+
+    op = optparse.OptionParser(usage="Usage: %prog [OPTIONS]")
+
+    og = optparse.OptionGroup(op, "Project options")
+    og.add_option("", "--pages", default="1000", metavar="N[,N...]",
+                  help="number of pages per project (default: 1000, try "
+                       "1000,10000,100000 to see how builds scale)")
+    og.add_option("", "--body-size", default=2000, type="int", metavar="BYTES",
+                  help="approximate size of page bodies (default: 2000)")
+    og.add_option("", "--posts", default=0.5, type="float", metavar="RATIO",
+                  help="ratio of pages which are blog posts (default: 0.5)")
+    og.add_option("", "--blocks", default=3, type="int", metavar="N",
+                  help="inline code blocks per page (default: 3)")
+    og.add_option("", "--depth", default=2, type="int", metavar="N",
+                  help="depth of nested page folders (default: 2)")
+    og.add_option("", "--assets", default=100, type="int", metavar="N",
+                  help="number of asset files (default: 100)")
+    og.add_option("", "--asset-size", default=10000, type="int",
+                  metavar="BYTES", help="size of asset files (default: 10000)")
+    og.add_option("", "--theme", default="minimal", metavar="THEME",
+                  help="theme to init projects with (default: minimal)")
+    og.add_option("", "--seed", default=0, type="int", metavar="N",
+                  help="seed for generating content (default: 0)")
+    op.add_option_group(og)
+
+    og = optparse.OptionGroup(op, "Benchmark options")
+    og.add_option("", "--build-args", default="", metavar="ARGS",
+                  help="additional build options, e.g. '--jobs 4'")
+    og.add_option("", "--repeat", default=3, type="int", metavar="N",
+                  help="runs per step, the fastest one counts (default: 3)")
+    og.add_option("", "--baseline", default=BASELINE, metavar="FILE",
+                  help="baseline file (default: bench-baseline.json)")
+    og.add_option("", "--save", action="store_true", default=False,
+                  help="save results as new baseline")
+    og.add_option("", "--tolerance", default=0.2, type="float",
+                  metavar="RATIO", help="slowdown which counts as regression "
+                                        "(default: 0.2)")
+    op.add_option_group(og)
+
+    opts, args = op.parse_args()
+    opts.pages = [int(n) for n in opts.pages.split(",")]
+    return opts
+
+def main():
+
+    opts = options()
+
+    # everything but the page count must match to compare with a baseline
+    params = dict(vars(opts))
+    for name in ("pages", "repeat", "baseline", "save", "tolerance"):
+        del params[name]
+
+    results = {}
+    for pages in opts.pages:
+        results[str(pages)] = bench(opts, pages)
+
+    if os.path.exists(SITES) and not os.listdir(SITES):
+        os.rmdir(SITES)
+
+    if opts.save:
+        with open(opts.baseline, 'w') as fp:
+            json.dump({"params": params, "results": results}, fp, indent=1,
+                      sort_keys=True)
+        print("saved baseline to %s" % opts.baseline)
+    elif os.path.exists(opts.baseline):
+        with open(opts.baseline) as fp:
+            baseline = json.load(fp)
+        if baseline["params"] != params:
+            print("baseline was taken with other parameters, not comparing")
+        elif compare(results, baseline["results"], opts.tolerance):
+            print("failed - builds got slower")
+            sys.exit(1)
+        else:
+            print("passed")
+
+if __name__ == '__main__':
+
+    main()
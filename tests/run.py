@@ -6,8 +6,9 @@ import shutil
 import subprocess
 import sys
 
-HERE = os.path.dirname(__file__)
-POOLE = os.path.join(HERE, "..", "poole.py")
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(HERE, "..")
+POOLE = [sys.executable, "-m", "poole._poole"]
 ACTUAL = os.path.join(HERE, "actual")
 EXPECTED = os.path.join(HERE, "expected")
 ERRORS = os.path.join(HERE, "errors.diff")
@@ -20,15 +21,19 @@ if os.path.exists(ACTUAL):
 if os.path.exists(ERRORS):
     os.remove(ERRORS)
 
-cmd_init = [POOLE, ACTUAL, "--init"]
-cmd_build = [POOLE, ACTUAL, "--build"]
-cmd_diff = ["diff", "-Naur", EXPECTED, ACTUAL]
+env = dict(os.environ)
+env["PYTHONPATH"] = os.pathsep.join(
+    [ROOT] + [p for p in [env.get("PYTHONPATH")] if p])
 
-r = subprocess.call(cmd_init, stdout=subprocess.PIPE)
+cmd_init = POOLE + [ACTUAL, "--init"]
+cmd_build = POOLE + [ACTUAL, "--build"]
+cmd_diff = ["diff", "-Naur", "-x", ".poole", EXPECTED, ACTUAL]
+
+r = subprocess.call(cmd_init, stdout=subprocess.PIPE, env=env)
 if r != EX_OK:
     sys.exit(1)
 
-r = subprocess.call(cmd_build, stdout=subprocess.PIPE)
+r = subprocess.call(cmd_build, stdout=subprocess.PIPE, env=env)
 if r != EX_OK:
     sys.exit(1)
 
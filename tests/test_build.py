@@ -0,0 +1,573 @@
+#!/usr/bin/env python
+
+"""Tests building small projects and the files written by builds."""
+
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from xml.dom import minidom
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(HERE, "..")
+
+sys.path.insert(0, ROOT)
+
+from poole import _poole
+
+PAGE_HTML = """<html><body>
+<!--%
+for p in pages.sorted_by("title"):
+    print('<a href="%s">%s</a>' % (p["url"], p["title"]))
+%-->
+<div>{{ __content__ }}</div>
+</body></html>
+"""
+
+def poole(project, *args):
+    """Run Poole on a project, return its exit status and output."""
+
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [ROOT] + [p for p in [env.get("PYTHONPATH")] if p])
+    p = subprocess.Popen([sys.executable, "-m", "poole._poole", project] +
+                         list(args), stdout=subprocess.PIPE,
+                         stderr=subprocess.STDOUT, env=env)
+    out = p.communicate()[0]
+    return p.returncode, out
+
+class ProjectTestCase(unittest.TestCase):
+    """Base class for tests which build a project in a temporary folder."""
+
+    def setUp(self):
+
+        self.project = tempfile.mkdtemp(prefix="poole-test-")
+        os.mkdir(os.path.join(self.project, "input"))
+        os.mkdir(os.path.join(self.project, "output"))
+        self.write("page.html", PAGE_HTML)
+
+    def tearDown(self):
+
+        shutil.rmtree(self.project)
+
+    def write(self, fname, content):
+        """Write a project file, making sure its modification time changes."""
+
+        fname = os.path.join(self.project, fname)
+        if os.path.exists(fname):
+            mtime = os.path.getmtime(fname)
+        else:
+            mtime = None
+            if not os.path.exists(os.path.dirname(fname)):
+                os.makedirs(os.path.dirname(fname))
+        with open(fname, 'w') as fp:
+            fp.write(content)
+        if mtime is not None and os.path.getmtime(fname) <= mtime:
+            os.utime(fname, (mtime + 1, mtime + 1))
+
+    def read(self, fname):
+
+        with open(os.path.join(self.project, "output", fname)) as fp:
+            return fp.read()
+
+    def exists(self, fname):
+
+        return os.path.exists(os.path.join(self.project, "output", fname))
+
+    def build(self, *args):
+        """Build the project, return the output of Poole."""
+
+        status, out = poole(self.project, "--build", *args)
+        if status:
+            self.fail("build failed:\n%s" % out)
+        return out
+
+    def rendered(self, out):
+        """Get the URLs of the pages rendered by a build."""
+
+        return sorted(line.split()[-1] for line in out.splitlines()
+                      if line.startswith("info   : render "))
+
+class IncrementalTest(ProjectTestCase):
+
+    def setUp(self):
+
+        ProjectTestCase.setUp(self)
+        self.write("input/a.md", "title: A\n---\nText of a.\n")
+        self.write("input/b.md", "title: B\n---\nText of b.\n")
+        self.write("input/style.css", "body {}\n")
+
+    def test_noop(self):
+
+        out = self.build("--incremental")
+        self.assertEqual(self.rendered(out), ["a.html", "b.html"])
+        out = self.build("--incremental")
+        self.assertEqual(self.rendered(out), [])
+
+    def test_changed_source(self):
+
+        self.build("--incremental")
+        self.write("input/a.md", "title: A\n---\nNew text of a.\n")
+        out = self.build("--incremental")
+        self.assertEqual(self.rendered(out), ["a.html"])
+        self.assertTrue("New text of a." in self.read("a.html"))
+
+    def test_changed_attributes(self):
+
+        self.build("--incremental")
+        self.write("input/a.md", "title: A2\n---\nText of a.\n")
+        out = self.build("--incremental")
+        # page.html lists all page titles
+        self.assertEqual(self.rendered(out), ["a.html", "b.html"])
+        self.assertTrue(">A2</a>" in self.read("b.html"))
+
+    def test_prune(self):
+
+        self.build("--incremental")
+        os.remove(os.path.join(self.project, "input", "b.md"))
+        os.remove(os.path.join(self.project, "input", "style.css"))
+        out = self.build("--incremental")
+        self.assertEqual(self.rendered(out), ["a.html"])
+        self.assertFalse(self.exists("b.html"))
+        self.assertFalse(self.exists("style.css"))
+        self.assertFalse(">B</a>" in self.read("a.html"))
+
+    def test_prune_converted(self):
+
+        self.write("macros.py", (
+            "import shutil\n"
+            "def up(src, dst):\n"
+            "    shutil.copy(src, dst)\n"
+            "converter = {r'\\.up$': (up, 'css')}\n"))
+        self.write("input/x.up", "body {}\n")
+        self.build("--incremental")
+        self.assertTrue(self.exists("x.css"))
+        os.remove(os.path.join(self.project, "input", "x.up"))
+        self.build("--incremental")
+        self.assertFalse(self.exists("x.css"))
+
+    def test_virtual_page_from_postconvert_hook(self):
+
+        self.write("macros.py", (
+            "def hook_postconvert_tags():\n"
+            "    pages.append(Page('tags.md', virtual='tags'))\n"))
+        for _ in range(2): # 2nd build has a manifest
+            self.build("--incremental")
+            self.assertTrue(self.exists("tags.html"))
+            self.assertTrue("Text of a." in self.read("a.html"))
+
+    def test_changed_source_of_other_page(self):
+
+        self.write("input/index.md", (
+            "{%\nfor p in pages.having('post'):\n"
+            "    print(p.source)\n%}\n"))
+        self.write("input/post.2020-01-01.news.md", "Old news.\n")
+        self.build("--incremental")
+        self.write("input/post.2020-01-01.news.md", "Fresh news.\n")
+        self.build("--incremental")
+        self.assertTrue("Fresh news." in self.read("index.html"))
+
+    def test_changed_html_of_other_page(self):
+
+        self.write("page.html", (
+            "{{ __content__ }}\n<!--%\nif page.url == 'a.html':\n"
+            "    print(pages.where(url='b.html')[0].html)\n%-->\n"))
+        self.build("--incremental")
+        self.write("input/b.md", "title: B\n---\nNew text of b.\n")
+        self.build("--incremental")
+        self.assertTrue("New text of b." in self.read("a.html"))
+
+    def test_cached_fragment(self):
+
+        self.write("macros.py", (
+            "@cached_fragment()\n"
+            "def menu():\n"
+            "    for p in pages.sorted_by('title'):\n"
+            "        print('<li>%s</li>' % p['title'])\n"))
+        self.write("page.html", "{% menu() %}\n{{ __content__ }}\n")
+        self.build("--incremental")
+        self.write("input/a.md", "title: A2\n---\nText of a.\n")
+        out = self.build("--incremental")
+        self.assertEqual(self.rendered(out), ["a.html", "b.html"])
+        self.assertTrue("<li>A2</li>" in self.read("b.html"))
+
+class OutputTest(ProjectTestCase):
+
+    def setUp(self):
+
+        ProjectTestCase.setUp(self)
+        self.write("input/a.md", "Text of a.\n")
+
+    def changes(self):
+
+        fname = os.path.join(self.project, ".poole", "changes.json")
+        with open(fname) as fp:
+            return json.load(fp)
+
+    def test_unchanged_files_untouched(self):
+
+        self.build()
+        fname = os.path.join(self.project, "output", "a.html")
+        os.utime(fname, (1, 1))
+        self.build()
+        self.assertEqual(os.path.getmtime(fname), 1)
+        self.assertEqual(self.changes(),
+                         {"added": [], "changed": [], "deleted": []})
+
+    def test_prune(self):
+
+        self.write("output/old.html", "old")
+        self.write("output/old/page.html", "old")
+        self.build()
+        self.assertFalse(self.exists("old.html"))
+        self.assertFalse(self.exists("old"))
+        self.assertEqual(self.changes()["deleted"],
+                         ["old.html", "old/page.html"])
+
+    def test_keep_hidden(self):
+
+        # e.g. a checkout of the branch a site gets published from
+        self.write("output/.git/HEAD", "ref: refs/heads/gh-pages\n")
+        self.write("output/.htaccess", "Options -Indexes\n")
+        self.build()
+        self.assertTrue(self.exists(".git/HEAD"))
+        self.assertTrue(self.exists(".htaccess"))
+        self.assertEqual(self.changes()["deleted"], [])
+
+class FeedTest(ProjectTestCase):
+
+    def setUp(self):
+
+        ProjectTestCase.setUp(self)
+        self.write("input/blog.2020-01-01.first_post.md", "First.\n")
+        self.write("input/blog.2020-02-01.second_post.md", "Second.\n")
+        self.write("input/about.md", "sitemap: no\n---\nAbout.\n")
+        self.write("input/index.md", "Home.\n")
+
+    def texts(self, fname, tag):
+
+        dom = minidom.parseString(self.read(fname))
+        return [e.firstChild.data for e in dom.getElementsByTagName(tag)]
+
+    def test_atom(self):
+
+        self.build("--feed", "atom", "--site-url", "http://example.org/")
+        self.assertEqual(self.texts("atom.xml", "title")[1:],
+                         ["second post", "first post"])
+        self.assertEqual(self.texts("atom.xml", "id")[1:], [
+            "http://example.org/blog.2020-02-01.second_post.html",
+            "http://example.org/blog.2020-01-01.first_post.html"])
+        self.assertTrue("Second." in self.texts("atom.xml", "content")[0])
+
+    def test_rss(self):
+
+        self.build("--feed", "rss", "--site-url", "http://example.org/")
+        self.assertEqual(self.texts("rss.xml", "title")[1:],
+                         ["second post", "first post"])
+        self.assertEqual(self.texts("rss.xml", "pubDate"), [
+            "Sat, 01 Feb 2020 00:00:00 GMT", "Wed, 01 Jan 2020 00:00:00 GMT"])
+
+    def test_sitemap(self):
+
+        self.build("--sitemap", "--site-url", "http://example.org/")
+        self.assertEqual(self.texts("sitemap.xml", "loc"), [
+            "http://example.org/blog.2020-01-01.first_post.html",
+            "http://example.org/blog.2020-02-01.second_post.html",
+            "http://example.org/index.html"])
+        self.assertEqual(self.texts("sitemap.xml", "lastmod"),
+                         ["2020-01-01", "2020-02-01"])
+
+class SitemapTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.dir = tempfile.mkdtemp(prefix="poole-test-")
+        self.saved = _poole.SITEMAP_MAX_BYTES
+
+    def tearDown(self):
+
+        _poole.SITEMAP_MAX_BYTES = self.saved
+        shutil.rmtree(self.dir)
+
+    def urls(self, fname):
+
+        dom = minidom.parse(fname)
+        return [e.firstChild.data for e in dom.getElementsByTagName("loc")]
+
+    def check(self, n, files):
+        """Write a sitemap of `n` pages, check it is split into `files`."""
+
+        entries = [("p%d.html" % i, None) for i in range(n)]
+        fnames = _poole.write_sitemap(entries, self.dir, "http://x.org/")
+        self.assertEqual(sorted(os.listdir(self.dir)),
+                         sorted(os.path.basename(f) for f in fnames))
+        index = os.path.join(self.dir, "sitemap.xml")
+        if files == 1:
+            self.assertEqual(fnames, [index])
+            self.assertEqual(len(self.urls(index)), n)
+            return []
+        self.assertEqual(len(fnames), files + 1)
+        self.assertEqual(self.urls(index), ["http://x.org/sitemap-%d.xml" % i
+                                            for i in range(1, files + 1)])
+        urls = []
+        for fname in fnames[1:]:
+            self.assertTrue(os.path.getsize(fname) <=
+                            _poole.SITEMAP_MAX_BYTES)
+            urls.append(len(self.urls(fname)))
+        self.assertEqual(sum(urls), n)
+        return urls
+
+    def test_single(self):
+
+        self.check(0, 1)
+        self.check(_poole.SITEMAP_MAX_URLS, 1)
+
+    def test_split_by_urls(self):
+
+        urls = self.check(_poole.SITEMAP_MAX_URLS + 1, 2)
+        self.assertEqual(urls, [_poole.SITEMAP_MAX_URLS, 1])
+
+    def test_split_by_size(self):
+
+        _poole.SITEMAP_MAX_BYTES = 1000 # room for 20 URLs
+        self.assertEqual(self.check(100, 5), [20] * 5)
+
+class MarkdownCacheTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.dir = tempfile.mkdtemp(prefix="poole-test-")
+        self.cache = _poole.MarkdownCache(self.dir, 250, "salt")
+        self.convert = self.cache.wrap(lambda text: text * 10)
+        self.walk = os.walk
+        _poole._counters.clear()
+
+    def tearDown(self):
+
+        os.walk = self.walk
+        _poole._counters.clear()
+        shutil.rmtree(self.dir)
+
+    def entries(self):
+
+        return sorted(f for cwd, dirs, files in self.walk(self.dir)
+                      for f in files if f != "size")
+
+    def test_evict(self):
+
+        for text in u"abcd":
+            self.convert(text * 10) # 100 bytes
+        entries = self.entries()
+        for i, fname in enumerate(entries): # least recently used first
+            os.utime(os.path.join(self.dir, fname[:2], fname), (i, i))
+        self.cache.evict()
+        self.assertEqual(self.entries(), entries[2:])
+
+    def test_scan_only_if_needed(self):
+
+        self.convert(u"a" * 10)
+        self.cache.evict() # size not known yet
+        _poole._counters.clear()
+
+        def walk(dname):
+            self.fail("cache scanned")
+
+        os.walk = walk
+        self.assertEqual(self.convert(u"a" * 10), u"a" * 100) # hit
+        self.convert(u"b" * 10)
+        self.cache.evict() # 200 bytes
+        os.walk = self.walk
+        self.convert(u"c" * 10)
+        self.cache.evict() # 300 bytes, scan and evict
+        self.assertEqual(len(self.entries()), 2)
+
+class FingerprintTest(ProjectTestCase):
+
+    CSS = "body { color: red; }\n"
+    PNG = "not really a PNG"
+
+    def setUp(self):
+
+        ProjectTestCase.setUp(self)
+        self.write("page.html", (
+            '<link href="/css/site.css"><link href="/css/site.css?v=1">\n'
+            '<a href="/about.html">about</a>\n'
+            '<a href="http://other.org/css/site.css">other</a>\n'
+            '<a href="{{ asset_url(\'/css/site.css\') }}">css</a>\n'
+            '<a href="http://example.org/site/img/logo.png">logo</a>\n'
+            '{{ __content__ }}\n'))
+        self.write("input/css/site.css", self.CSS)
+        self.write("input/img/logo.png", self.PNG)
+        self.write("input/about.md", "<img src=\"img/logo.png\">\n")
+        self.write("input/blog/post.md", (
+            "<img src='../img/logo.png'> <img src=\"logo.png\">\n"))
+        self.css = "css/site.%s.css" % hashlib.sha1(self.CSS).hexdigest()[:10]
+        self.png = "img/logo.%s.png" % hashlib.sha1(self.PNG).hexdigest()[:10]
+
+    def links(self, fname):
+
+        return re.findall(r'(?:href|src)=["\']([^"\']*)', self.read(fname))
+
+    def test_fingerprint(self):
+
+        self.build("--fingerprint")
+        self.assertEqual(self.links("about.html"), [
+            "/" + self.css, "/%s?v=1" % self.css, "/about.html",
+            "http://other.org/css/site.css", "/" + self.css,
+            "http://example.org/site/img/logo.png", self.png])
+        # page-relative links, a missing asset is left alone
+        self.assertEqual(self.links("blog/post.html")[-2:],
+                         ["../" + self.png, "logo.png"])
+        self.assertEqual(self.read(self.css), self.CSS)
+        self.assertEqual(self.read(self.png), self.PNG)
+        fname = os.path.join(self.project, ".poole", "assets.json")
+        with open(fname) as fp:
+            self.assertEqual(json.load(fp), {"css/site.css": self.css,
+                                             "img/logo.png": self.png})
+
+    def test_absolute_base_url(self):
+
+        self.build("--fingerprint", "--base-url", "http://example.org/site/")
+        self.assertEqual(self.links("about.html"), [
+            "/css/site.css", "/css/site.css?v=1", "/about.html",
+            "http://other.org/css/site.css",
+            "http://example.org/site/" + self.css,
+            "http://example.org/site/" + self.png, self.png])
+
+class ShardTest(ProjectTestCase):
+
+    def setUp(self):
+
+        ProjectTestCase.setUp(self)
+        for i in range(8):
+            self.write("input/p%d.md" % i, "Text of page %d.\n" % i)
+            self.write("input/css/s%d.css" % i, "body {}\n")
+
+    def files(self, dname):
+        """Get the files in a folder by relative name (but shard manifests)."""
+
+        files = {}
+        for cwd, dirs, fnames in os.walk(dname):
+            for f in fnames:
+                if f != ".poole-shard.json":
+                    with open(os.path.join(cwd, f)) as fp:
+                        rel = os.path.relpath(os.path.join(cwd, f), dname)
+                        files[rel] = fp.read()
+        return files
+
+    def build_shards(self, n):
+        """Build all shards of the project, return their output folders."""
+
+        dirs = []
+        for i in range(1, n + 1):
+            dir_out = os.path.join(self.project, "output")
+            shutil.rmtree(dir_out)
+            os.mkdir(dir_out)
+            self.build("--shard", "%d/%d" % (i, n))
+            dirs.append(os.path.join(self.project, "shards", str(i)))
+            shutil.copytree(dir_out, dirs[-1])
+        return dirs
+
+    def merge(self, dirs):
+
+        args = []
+        for dname in dirs:
+            args.extend(("--merge", dname))
+        return poole(self.project, *args)
+
+    def test_merge(self):
+
+        self.build()
+        full = self.files(os.path.join(self.project, "output"))
+        dirs = self.build_shards(3)
+        # each file is built by one shard only
+        built = [set(self.files(d)) for d in dirs]
+        self.assertEqual(sum(len(b) for b in built), len(full))
+        status, out = self.merge(dirs)
+        self.assertEqual(status, 0, out)
+        self.assertEqual(self.files(os.path.join(self.project, "output")),
+                         full)
+
+    def test_merge_keeps_hidden(self):
+
+        dirs = self.build_shards(2)
+        self.write("output/.git/HEAD", "ref: refs/heads/gh-pages\n")
+        self.assertEqual(self.merge(dirs)[0], 0)
+        self.assertTrue(self.exists(".git/HEAD"))
+        self.assertTrue(self.exists("p1.html"))
+
+    def test_merge_into_itself(self):
+
+        dirs = self.build_shards(2)
+        dirs[-1] = os.path.join(self.project, "output") # built in place
+        before = self.files(dirs[-1])
+        status, out = self.merge(dirs)
+        self.assertEqual(status, 1)
+        self.assertTrue("abort  : can't merge" in out)
+        self.assertEqual(self.files(dirs[-1]), before)
+
+    def test_missing_shard(self):
+
+        dirs = self.build_shards(3)
+        status, out = self.merge(dirs[:2])
+        self.assertEqual(status, 1)
+        self.assertTrue("abort  : missing shards 3/3" in out)
+
+    def test_conflict(self):
+
+        dirs = self.build_shards(2)
+        for i, dname in enumerate(dirs): # as written by a hook in each shard
+            with open(os.path.join(dname, "extra.txt"), 'w') as fp:
+                fp.write("shard %d\n" % i)
+            fname = os.path.join(dname, ".poole-shard.json")
+            with open(fname) as fp:
+                manifest = json.load(fp)
+            manifest["files"]["extra.txt"] = str(i)
+            with open(fname, 'w') as fp:
+                json.dump(manifest, fp)
+        status, out = self.merge(dirs)
+        self.assertEqual(status, 1)
+        self.assertTrue("error  : shards built different versions of "
+                        "extra.txt" in out)
+        self.assertTrue("abort  : 1 conflicting files" in out)
+        self.assertFalse(self.exists("extra.txt"))
+
+class ErrorTest(ProjectTestCase):
+
+    def test_writer_stopped(self):
+
+        self.write("input/a.md", "{{ 1 / 0 }}\n")
+        script = (
+            "import sys, threading\n"
+            "from poole import _poole\n"
+            "opts = _poole.options(['--build', sys.argv[1]])\n"
+            "for _ in range(2):\n"
+            "    try:\n"
+            "        _poole.build(sys.argv[1], opts)\n"
+            "    except SystemExit:\n"
+            "        pass\n"
+            "sys.__stdout__.write('threads: %d' % threading.active_count())\n")
+        env = dict(os.environ, PYTHONPATH=ROOT)
+        p = subprocess.Popen([sys.executable, "-c", script, self.project],
+                             stdout=subprocess.PIPE, env=env)
+        out = p.communicate()[0]
+        self.assertTrue(out.endswith("threads: 1"), out)
+
+    def test_invalid_cache_key(self):
+
+        self.write("input/a.md", "{%\n# cache: page[\n%}\n")
+        status, out = poole(self.project, "--build")
+        self.assertEqual(status, 1)
+        self.assertTrue("abort  : Python statements in" in out)
+        self.assertTrue(out.rstrip().endswith("SyntaxError: unexpected EOF "
+                                              "while parsing"))
+
+if __name__ == '__main__':
+
+    unittest.main()
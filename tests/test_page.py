@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests of pages and page lists."""
+
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                ".."))
+
+from poole._poole import Page, PageList
+
+class PageTestCase(unittest.TestCase):
+    """Base class for tests using virtual pages."""
+
+    def setUp(self):
+
+        self.saved = Page._template, Page._pstrip
+        Page._template = {}
+        Page._pstrip = os.path.abspath("input")
+
+    def tearDown(self):
+
+        Page._template, Page._pstrip = self.saved
+
+    def page(self, fname, source="text\n", **attrs):
+
+        return Page(fname, virtual=source, **attrs)
+
+class PageTest(PageTestCase):
+
+    def test_attributes(self):
+
+        page = self.page("news/post.2020-01-02.hello_world.md", "text\n",
+                         author="me")
+        self.assertEqual(page.url, "news/post.2020-01-02.hello_world.html")
+        self.assertEqual(page.title, "post")
+        self.assertEqual(page.date, "2020-01-02")
+        self.assertEqual(page.post, "hello world")
+        self.assertEqual(page.author, "me")
+        self.assertEqual(page.source, "text\n")
+        self.assertRaises(AttributeError, lambda: page.missing)
+
+    def test_released_html(self):
+
+        page = self.page("a.md", "text\n")
+        page.html = u"<p>text</p>"
+        page.unload()
+        self.assertEqual(page.html, u"<p>text</p>")
+        page.release()
+        try:
+            page.html
+        except AttributeError as e:
+            self.assertTrue("has been released" in str(e))
+        else:
+            self.fail("released HTML is still available")
+
+class PageListTest(PageTestCase):
+
+    def setUp(self):
+
+        PageTestCase.setUp(self)
+        self.a = self.page("a.md", tags="x", n="10")
+        self.b = self.page("b.md", tags="y", n="9")
+        self.c = self.page("c.md", tags="x")
+        self.pages = PageList([self.a, self.b, self.c])
+
+    def test_having(self):
+
+        self.assertEqual(self.pages.having("tags"),
+                         [self.a, self.b, self.c])
+        self.assertEqual(self.pages.having("tags", "n"), [self.a, self.b])
+        self.assertEqual(self.pages.having("missing"), [])
+
+    def test_where(self):
+
+        self.assertEqual(self.pages.where(tags="x"), [self.a, self.c])
+        self.assertEqual(self.pages.where({"tags": "x", "n": "10"}),
+                         [self.a])
+        self.assertEqual(self.pages.where(tags="z"), [])
+        self.assertEqual(self.pages.where(), [self.a, self.b, self.c])
+        self.b["tags"] = ["unhashable"]
+        self.assertEqual(self.pages.where(tags="y"), [])
+
+    def test_sorted_by(self):
+
+        self.assertEqual(self.pages.sorted_by("n"), [self.a, self.b])
+        self.assertEqual(self.pages.sorted_by("n", key=int), [self.b, self.a])
+        self.assertEqual(self.pages.sorted_by("n", key=int, reverse=True),
+                         [self.a, self.b])
+        # stable for equal values
+        self.assertEqual(self.pages.sorted_by("tags"),
+                         [self.a, self.c, self.b])
+
+    def test_sorted_by_key_not_cached(self):
+
+        for _ in range(3):
+            self.pages.sorted_by("n", key=lambda v: -int(v))
+        self.assertEqual(len(self.pages._indexes), 1) # pages having "n"
+
+    def test_page_changes(self):
+
+        self.assertEqual(self.pages.where(tags="x"), [self.a, self.c])
+        self.c["tags"] = "y"
+        self.assertEqual(self.pages.where(tags="x"), [self.a])
+        del self.a["tags"]
+        self.assertEqual(self.pages.having("tags"), [self.b, self.c])
+        self.b.update(n="11")
+        self.assertEqual(self.pages.sorted_by("n", key=int), [self.a, self.b])
+
+    def test_list_changes(self):
+
+        self.assertEqual(self.pages.where(tags="x"), [self.a, self.c])
+        d = self.page("d.md", tags="x")
+        self.pages.append(d)
+        self.assertEqual(self.pages.where(tags="x"), [self.a, self.c, d])
+        self.pages.remove(self.a)
+        self.assertEqual(self.pages.where(tags="x"), [self.c, d])
+        del self.pages[-1]
+        self.assertEqual(self.pages.where(tags="x"), [self.c])
+        self.pages[:] = [self.a]
+        self.assertEqual(self.pages.where(tags="x"), [self.a])
+
+    def test_results_are_copies(self):
+
+        result = self.pages.having("tags")
+        result.pop()
+        self.assertEqual(self.pages.having("tags"),
+                         [self.a, self.b, self.c])
+
+class Options(object):
+    """Command line options used by pages."""
+
+    input_enc = "utf-8"
+
+class PageFileTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.saved = Page._template, Page._pstrip, Page._opts
+        self.dir_in = tempfile.mkdtemp(prefix="poole-test-")
+        Page._template = {}
+        Page._pstrip = self.dir_in
+        Page._opts = Options()
+
+    def tearDown(self):
+
+        Page._template, Page._pstrip, Page._opts = self.saved
+        shutil.rmtree(self.dir_in)
+
+    def test_header(self):
+
+        fname = os.path.join(self.dir_in, "a.md")
+        data = u"title: Ä\n---\nline 1\r\nline 2\n".encode("utf-8")
+        with open(fname, 'wb') as fp:
+            fp.write(data)
+        page = Page(fname)
+        self.assertEqual(page.title, u"Ä")
+        self.assertEqual(page.source, u"line 1\r\nline 2\n")
+        self.assertEqual(Page._headers[fname][3],
+                         hashlib.sha1(data).hexdigest())
+
+if __name__ == '__main__':
+
+    unittest.main()
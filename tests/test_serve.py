@@ -0,0 +1,298 @@
+#!/usr/bin/env python
+
+"""Tests of the web server used by `poole --serve`."""
+
+import gzip
+import os
+import shutil
+import StringIO
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "..", "poole"))
+
+from _serve import FileCache, RequestHandler
+
+class Output(StringIO.StringIO):
+    """Response stream which keeps its content when closed."""
+
+    def close(self):
+        pass
+
+class Connection(object):
+    """Fake socket connection, reading a request and recording the response."""
+
+    def __init__(self, request):
+
+        self.request = request
+        self.response = Output()
+
+    def makefile(self, mode, bufsize=None):
+
+        return StringIO.StringIO(self.request) if "r" in mode else \
+               self.response
+
+class Handler(RequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+def gzipped(data):
+
+    out = StringIO.StringIO()
+    fp = gzip.GzipFile(fileobj=out, mode='wb')
+    fp.write(data)
+    fp.close()
+    return out.getvalue()
+
+def gunzipped(data):
+
+    return gzip.GzipFile(fileobj=StringIO.StringIO(data)).read()
+
+class ServeTestCase(unittest.TestCase):
+    """Base class for tests serving files in a temporary folder."""
+
+    def setUp(self):
+
+        self.root = tempfile.mkdtemp(prefix="poole-test-")
+        Handler.root = self.root
+        Handler.cache = FileCache(64 * 1024, 256)
+
+    def tearDown(self):
+
+        shutil.rmtree(self.root)
+
+    def write(self, fname, data, mtime=None):
+
+        fname = os.path.join(self.root, fname)
+        if not os.path.exists(os.path.dirname(fname)):
+            os.makedirs(os.path.dirname(fname))
+        with open(fname, 'wb') as fp:
+            fp.write(data)
+        if mtime is not None:
+            os.utime(fname, (mtime, mtime))
+
+    def request(self, path, method="GET", **headers):
+        """Send a request, return the status, headers and body of the reply.
+
+        Header names are given with underscores instead of dashes.
+
+        """
+        lines = ["%s %s HTTP/1.1" % (method, path), "Host: localhost"]
+        lines.extend("%s: %s" % (name.replace("_", "-"), value)
+                     for name, value in headers.items())
+        conn = Connection("\r\n".join(lines) + "\r\n\r\n")
+        Handler(conn, ("127.0.0.1", 0), None)
+        head, body = conn.response.getvalue().split("\r\n\r\n", 1)
+        head = head.split("\r\n")
+        reply = {}
+        for line in head[1:]:
+            name, value = line.split(":", 1)
+            reply[name.lower()] = value.strip()
+        return int(head[0].split()[1]), reply, body
+
+class RequestTest(ServeTestCase):
+
+    def setUp(self):
+
+        ServeTestCase.setUp(self)
+        self.write("a.txt", "0123456789")
+        self.write("sub/index.html", "<p>sub</p>")
+
+    def test_get(self):
+
+        status, headers, body = self.request("/a.txt")
+        self.assertEqual(status, 200)
+        self.assertEqual(body, "0123456789")
+        self.assertEqual(headers["content-length"], "10")
+        self.assertEqual(headers["content-type"], "text/plain")
+        self.assertEqual(headers["accept-ranges"], "bytes")
+        self.assertTrue("etag" in headers and "last-modified" in headers)
+
+    def test_head(self):
+
+        status, headers, body = self.request("/a.txt", "HEAD")
+        self.assertEqual(status, 200)
+        self.assertEqual(headers["content-length"], "10")
+        self.assertEqual(body, "")
+
+    def test_not_found(self):
+
+        self.assertEqual(self.request("/missing.html")[0], 404)
+
+    def test_directory(self):
+
+        status, headers, _ = self.request("/sub?x=1")
+        self.assertEqual(status, 301)
+        self.assertEqual(headers["location"], "/sub/?x=1")
+        status, _, body = self.request("/sub/")
+        self.assertEqual((status, body), (200, "<p>sub</p>"))
+
+    def test_etag(self):
+
+        etag = self.request("/a.txt")[1]["etag"]
+        status, headers, body = self.request("/a.txt", If_None_Match=etag)
+        self.assertEqual((status, body), (304, ""))
+        self.assertEqual(headers["etag"], etag)
+        status = self.request("/a.txt", If_None_Match='"other", *')[0]
+        self.assertEqual(status, 304)
+        status = self.request("/a.txt", If_None_Match='"other"')[0]
+        self.assertEqual(status, 200)
+
+    def test_if_modified_since(self):
+
+        self.write("a.txt", "0123456789", mtime=1000000000)
+        status = self.request("/a.txt", If_Modified_Since=(
+            "Sun, 09 Sep 2001 01:46:40 GMT"))[0]
+        self.assertEqual(status, 304)
+        status = self.request("/a.txt", If_Modified_Since=(
+            "Sun, 09 Sep 2001 01:46:39 GMT"))[0]
+        self.assertEqual(status, 200)
+        status = self.request("/a.txt", If_Modified_Since="garbage")[0]
+        self.assertEqual(status, 200)
+
+class RangeTest(ServeTestCase):
+
+    def setUp(self):
+
+        ServeTestCase.setUp(self)
+        self.write("a.txt", "0123456789")
+
+    def check(self, rng, status, body, content_range=None, **headers):
+
+        reply = self.request("/a.txt", Range=rng, **headers)
+        self.assertEqual((reply[0], reply[2]), (status, body))
+        self.assertEqual(reply[1].get("content-range"), content_range)
+        self.assertEqual(reply[1]["content-length"], str(len(body)))
+
+    def test_ranges(self):
+
+        self.check("bytes=2-4", 206, "234", "bytes 2-4/10")
+        self.check("bytes=7-", 206, "789", "bytes 7-9/10")
+        self.check("bytes=8-20", 206, "89", "bytes 8-9/10")
+        self.check("bytes=-3", 206, "789", "bytes 7-9/10")
+        self.check("bytes=-20", 206, "0123456789", "bytes 0-9/10")
+
+    def test_unsatisfiable(self):
+
+        self.check("bytes=10-", 416, "", "bytes */10")
+        self.check("bytes=5-4", 416, "", "bytes */10")
+        self.check("bytes=-0", 416, "", "bytes */10")
+
+    def test_ignored(self):
+
+        # multiple or malformed ranges get the full content
+        self.check("bytes=0-1,3-4", 200, "0123456789")
+        self.check("bytes=-", 200, "0123456789")
+        self.check("lines=1-2", 200, "0123456789")
+
+    def test_if_range(self):
+
+        etag = self.request("/a.txt")[1]["etag"]
+        self.check("bytes=0-1", 206, "01", "bytes 0-1/10", If_Range=etag)
+        self.check("bytes=0-1", 200, "0123456789", If_Range='"old"')
+
+    def test_uncached(self):
+
+        Handler.cache = FileCache(64, 256) # file too large to be cached
+        self.check("bytes=2-4", 206, "234", "bytes 2-4/10")
+        self.check("bytes=0-", 206, "0123456789", "bytes 0-9/10")
+
+class GzipTest(ServeTestCase):
+
+    data = "body { color: red; }\n" * 20
+
+    def setUp(self):
+
+        ServeTestCase.setUp(self)
+        self.write("a.css", self.data)
+        self.write("small.css", "body {}\n")
+        self.write("a.png", self.data)
+
+    def test_gzip(self):
+
+        status, headers, body = self.request("/a.css",
+                                             Accept_Encoding="gzip, deflate")
+        self.assertEqual(status, 200)
+        self.assertEqual(headers["content-encoding"], "gzip")
+        self.assertEqual(headers["vary"], "Accept-Encoding")
+        self.assertTrue(headers["etag"].endswith('-gz"'))
+        self.assertEqual(headers["content-length"], str(len(body)))
+        self.assertFalse("accept-ranges" in headers)
+        self.assertEqual(gunzipped(body), self.data)
+        # other clients get a different entity
+        status, headers, body = self.request("/a.css")
+        self.assertFalse("content-encoding" in headers)
+        self.assertFalse(headers["etag"].endswith('-gz"'))
+        self.assertEqual(body, self.data)
+
+    def test_not_compressed(self):
+
+        for path in ("/small.css", "/a.png"):
+            headers = self.request(path, Accept_Encoding="gzip")[1]
+            self.assertFalse("content-encoding" in headers)
+
+    def test_range_not_compressed(self):
+
+        status, headers, body = self.request("/a.css", Accept_Encoding="gzip",
+                                             Range="bytes=0-3")
+        self.assertEqual((status, body), (206, "body"))
+        self.assertFalse("content-encoding" in headers)
+
+    def test_precompressed(self):
+
+        # only used if at least as new as the file
+        mtime = time.time() - 10
+        self.write("a.css", self.data, mtime)
+        self.write("a.css.gz", gzipped("precompressed"), mtime - 1)
+        body = self.request("/a.css", Accept_Encoding="gzip")[2]
+        self.assertEqual(gunzipped(body), self.data)
+        self.write("a.css.gz", gzipped("precompressed"), mtime)
+        Handler.cache = FileCache(64 * 1024, 256)
+        body = self.request("/a.css", Accept_Encoding="gzip")[2]
+        self.assertEqual(gunzipped(body), "precompressed")
+
+class FileCacheTest(ServeTestCase):
+
+    def get(self, cache, fname):
+
+        path = os.path.join(self.root, fname)
+        return cache.get(path, os.stat(path), "text/plain")
+
+    def test_invalidate(self):
+
+        cache = FileCache(1000, 1000)
+        self.write("a.txt", "old", mtime=1000)
+        self.assertEqual(self.get(cache, "a.txt"), ("old", None))
+        self.write("a.txt", "new", mtime=1000) # same size and time
+        self.assertEqual(self.get(cache, "a.txt"), ("old", None))
+        self.write("a.txt", "new", mtime=2000)
+        self.assertEqual(self.get(cache, "a.txt"), ("new", None))
+
+    def test_evict(self):
+
+        cache = FileCache(800, 1000) # files up to 100 bytes, 8 of them
+        for i in range(9):
+            self.write("%d.txt" % i, "%d" % i * 100)
+        for i in range(8):
+            self.get(cache, "%d.txt" % i)
+        self.get(cache, "0.txt") # now 1.txt is least recently used
+        self.get(cache, "8.txt")
+        self.assertEqual(sorted(cache._entries), sorted(
+            os.path.join(self.root, "%d.txt" % i) for i in (0, 2, 3, 4, 5,
+                                                            6, 7, 8)))
+        self.assertEqual(cache._size, 800)
+
+    def test_too_large(self):
+
+        cache = FileCache(800, 1000)
+        self.write("a.txt", "x" * 101)
+        self.assertEqual(self.get(cache, "a.txt"), None)
+        self.assertEqual(cache._entries, {})
+
+if __name__ == '__main__':
+
+    unittest.main()
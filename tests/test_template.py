@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests of templates, in particular of rendering corner cases.
+
+Rendering a template must be equivalent to the way Poole always processed
+pages: first replace all expression blocks by their evaluation, then replace
+all statement blocks in the resulting text by their output.
+
+"""
+
+import os
+import random
+import re
+import StringIO
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                ".."))
+
+from poole._poole import BuildCache, Template
+
+RE_EVAL = re.compile(r'(?<!\\)(?:(?:<!--|{){)(.*?)(?:}(?:-->|}))', re.S)
+RE_EXEC = re.compile(r'(?<!\\)(?:(?:<!--|{)%)(.*?)(?:%(?:-->|}))', re.S)
+
+def run_eval(code, expr, where=None):
+
+    try:
+        return unicode(eval(code, {}))
+    except Exception as e:
+        return u"E(%s)" % type(e).__name__
+
+def run_exec(code, stmt, where=None):
+
+    stdout = sys.stdout
+    sys.stdout = StringIO.StringIO()
+    try:
+        try:
+            exec code in {}
+        except Exception as e:
+            print("X(%s)" % type(e).__name__)
+        return unicode(sys.stdout.getvalue()[:-1])
+    finally:
+        sys.stdout = stdout
+
+def reference(text):
+    """Render a template the way Poole did before templates were parsed."""
+
+    out = RE_EVAL.sub(lambda m: run_eval(m.group(1).lstrip(" \t"), None), text)
+
+    def repl(m):
+        stmt = m.group(1).replace("\r\n", "\n")
+        ind_lvl = len(re.findall(r'^(?: *\n)*( *)', stmt, re.MULTILINE)[0])
+        stmt = re.compile(r'^ {0,%d}' % ind_lvl, re.MULTILINE).sub('', stmt)
+        return run_exec(stmt, None)
+
+    return RE_EXEC.sub(repl, out)
+
+class RenderTest(unittest.TestCase):
+
+    def check(self, text):
+
+        self.assertEqual(Template(text).render(run_eval, run_exec),
+                         reference(text))
+
+    def test_plain(self):
+
+        self.check(u"no code at all")
+        self.check(u"")
+        self.check(u"ünïcode")
+
+    def test_blocks(self):
+
+        self.check(u"a {{ 1 + 1 }} b <!--{ 'x' }--> c")
+        self.check(u"a {% print 1 %} b <!--%\n  print 2\n  print 3\n%--> c")
+        self.check(u"{{ 1 }}{% print 2 %}{{ 3 }}")
+
+    def test_escaped(self):
+
+        self.check(u"\\{{ 1 }} \\{% print 2 %}")
+
+    def test_errors(self):
+
+        self.check(u"{{ 1 / 0 }} {{ ( }} {% ( %} {% raise ValueError %}")
+
+    def test_statement_using_expression(self):
+
+        # the statement's code is made of expression output
+        self.check(u"{% print {{ 1 + 1 }} %}")
+        self.check(u"<!--% print '{{ 'a' }}' + '{{ 'b' }}' %-->")
+
+    def test_expression_output_forming_statement(self):
+
+        # fallback: expression output which starts or ends statement blocks
+        self.check(u"{{ '{%' }} print 1 %}")
+        self.check(u"{% print 1 {{ '%}' }}")
+        self.check(u"<!-{{ '-%' }} print 1 %-->")
+        self.check(u"{{ '{' }}% print 2 %}")
+        self.check(u"{% print 3 %{{ '}' }}")
+        self.check(u"{{ '<!--%' }} print 4 {{ '%-->' }}")
+
+    def test_expression_output_not_forming_statement(self):
+
+        self.check(u"{{ '%' }} {{ '{' }} {{ '-' }} {% print 5 %}")
+
+    def test_random(self):
+
+        tokens = [u"{{", u"}}", u"{%", u"%}", u"<!--", u"-->", u"<!--{",
+                  u"}-->", u"<!--%", u"%-->", u"'{%'", u"'%}'", u"'%'",
+                  u"'-'", u"'}'", u"'{'", u" 1 ", u"print 2", u"\\", u"x",
+                  u"\n", u"'<!-'", u"%", u"-", u"{", u"}", u"\n  print 3\n"]
+        rng = random.Random(0)
+        for _ in range(3000):
+            self.check(u"".join(rng.choice(tokens)
+                                for _ in range(rng.randint(1, 12))))
+
+class LocationTest(unittest.TestCase):
+
+    def test_lines(self):
+
+        text = (u"line 1\n{{ 1 }}\n{% print 1\n%}\n\n{{ 2\n}} {{ 3 }}\n"
+                u"{% print 4 %}\n")
+        wheres = []
+
+        def ev(code, expr, where):
+            wheres.append(where)
+            return u"x"
+
+        def ex(code, stmt, where):
+            wheres.append(where)
+            return u"y"
+
+        Template(text, "page.md", 3).render(ev, ex)
+        self.assertEqual(wheres, [("page.md", 4), ("page.md", 8),
+                                  ("page.md", 9), ("page.md", 5),
+                                  ("page.md", 10)])
+
+    def test_names(self):
+
+        tpl = Template(u"{{ foo(page) }} {% print(bar) %}")
+        self.assertEqual(tpl.names(), set(["foo", "page", "bar"]))
+        # code depending on expression output is unknown in advance
+        self.assertEqual(Template(u"{% print {{ 1 }} %}").names(), None)
+        self.assertEqual(Template(u"{{ ( }}").names(), None)
+
+class BuildCacheTest(unittest.TestCase):
+
+    def test_forget_unused(self):
+
+        cache = BuildCache()
+        cache["a"] = cache["b"] = 1
+        cache.new_build()
+        self.assertTrue("a" in cache) # used by this build, keep it
+        cache.new_build()
+        self.assertTrue("a" in cache)
+        self.assertFalse("b" in cache)
+        self.assertEqual(len(cache), 1)
+        self.assertRaises(KeyError, lambda: cache["b"])
+
+    def test_template_codes(self):
+
+        Template(u"{{ 'unique' * 1234 }}")
+        self.assertTrue((u"'unique' * 1234 ", "eval") in Template._codes)
+        Template._codes.new_build()
+        Template._codes.new_build()
+        self.assertFalse((u"'unique' * 1234 ", "eval") in Template._codes)
+
+if __name__ == '__main__':
+
+    unittest.main()